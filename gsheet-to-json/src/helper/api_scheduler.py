@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+import email.utils
+import json
+import random
+import socket
+import ssl
+import threading
+import time
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from helper.logger import *
+
+
+class ApiScheduler(object):
+
+    """ every call to the sheets/drive apis goes through here - calls are rate limited per api (a token bucket per api sized to
+        its per-minute quota) and failed calls (429, 5xx, rate limit 403, network errors) are retried with jittered exponential
+        backoff, honoring Retry-After when the server sends one
+    """
+
+    __instance = None
+
+    def __new__(cls):
+        # one scheduler for all threads, the quotas are per project/user not per thread
+        if ApiScheduler.__instance is None:
+            ApiScheduler.__instance = object.__new__(cls)
+            ApiScheduler.__instance.init({})
+
+        return ApiScheduler.__instance
+
+    """ initialize from the api-scheduler configuration
+    """
+
+    def init(self, config):
+        self._buckets = {
+            "sheets": TokenBucket(
+                config.get("sheets-requests-per-minute", 60),
+                config.get("burst", 10),
+            ),
+            "drive": TokenBucket(
+                config.get("drive-requests-per-minute", 600),
+                config.get("burst", 10),
+            ),
+        }
+        self._max_retries = config.get("max-retries", 6)
+        self._backoff_base = float(config.get("backoff-base-seconds", 1))
+        self._backoff_max = float(config.get("backoff-max-seconds", 64))
+
+        self._lock = threading.Lock()
+        self._counters = {
+            api: {
+                "calls": 0,
+                "retries": 0,
+                "throttled": 0,
+                "failed": 0,
+                "wait-seconds": 0.0,
+                "backoff-seconds": 0.0,
+            }
+            for api in self._buckets.keys()
+        }
+
+    """ execute a googleapiclient request against an api (sheets/drive), on the given (thread's own) http if not None
+    """
+
+    def execute(self, api, request, http=None, nesting_level=0):
+        return self.call(
+            api, lambda: request.execute(http=http), nesting_level=nesting_level
+        )
+
+    """ call fn (that makes cost api requests) under the api's rate limit, retrying it while it fails with a retryable error
+    """
+
+    def call(self, api, fn, cost=1, nesting_level=0):
+        for attempt in range(0, self._max_retries + 1):
+            waited = self._buckets[api].acquire(cost)
+            self.count(api, "calls", 1)
+            self.count(api, "wait-seconds", waited)
+            try:
+                return fn()
+
+            except Exception as e:
+                if not is_retryable(e):
+                    self.count(api, "failed", 1)
+                    raise
+
+                if is_throttled(e):
+                    self.count(api, "throttled", 1)
+
+                if attempt == self._max_retries:
+                    self.count(api, "failed", 1)
+                    error(
+                        f"{api} api call failed after {attempt + 1} attempts : {e}",
+                        nesting_level=nesting_level,
+                    )
+                    raise
+
+                delay = self.backoff(attempt, retry_after(e))
+                warn(
+                    f"{api} api call failed (attempt {attempt + 1}), retrying in {delay:.1f} seconds : {e}",
+                    nesting_level=nesting_level,
+                )
+                self.count(api, "retries", 1)
+                self.count(api, "backoff-seconds", delay)
+                time.sleep(delay)
+
+    """ seconds to wait before the next attempt - full jitter over an exponentially growing window, at least what the server asked for
+    """
+
+    def backoff(self, attempt, retry_after_seconds=None):
+        delay = random.uniform(
+            0, min(self._backoff_max, self._backoff_base * (2**attempt))
+        )
+        if retry_after_seconds is not None:
+            delay = max(delay, retry_after_seconds)
+
+        return delay
+
+    """ add to a counter
+    """
+
+    def count(self, api, counter, value):
+        with self._lock:
+            self._counters[api][counter] = self._counters[api][counter] + value
+
+    """ the least seconds calls to an api take under its rate limit, starting with a full bucket
+    """
+
+    def min_seconds(self, api, calls):
+        return self._buckets[api].min_seconds(calls)
+
+    """ counters per api - calls, retries, throttled (429/rate limit) responses, failed calls, seconds waited for the rate limit and in backoff
+    """
+
+    def stats(self):
+        with self._lock:
+            return {api: dict(counters) for api, counters in self._counters.items()}
+
+
+class TokenBucket(object):
+
+    """ a bucket of at most burst tokens refilled at requests_per_minute/60 tokens a second, a call takes a token or waits for one
+    """
+
+    def __init__(self, requests_per_minute, burst=10):
+        self._rate = float(requests_per_minute) / 60
+        self._capacity = float(max(1, burst))
+        self._tokens = self._capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    """ take cost tokens, waiting until they are there, returns the seconds waited
+    """
+
+    def acquire(self, cost=1):
+        # a batch may cost more than the bucket holds, it then waits for a full bucket
+        cost = min(float(cost), self._capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self._capacity,
+                    self._tokens + (now - self._updated_at) * self._rate,
+                )
+                self._updated_at = now
+                if self._tokens >= cost:
+                    self._tokens = self._tokens - cost
+                    return waited
+
+                wait_for = (cost - self._tokens) / self._rate
+
+            time.sleep(wait_for)
+            waited = waited + wait_for
+
+    """ seconds it takes to take a token for each of calls calls, starting with a full bucket
+    """
+
+    def min_seconds(self, calls):
+        return max(0.0, calls - self._capacity) / self._rate
+
+
+""" whether a failed call may succeed if tried again
+"""
+
+
+def is_retryable(e):
+    if isinstance(e, HttpError):
+        return e.resp.status in RETRYABLE_STATUSES or is_throttled(e)
+
+    return isinstance(
+        e, (socket.timeout, ConnectionError, ssl.SSLError, httplib2.HttpLib2Error)
+    )
+
+
+""" whether a failed call was refused for going over a quota - 429, or 403 with a rate limit reason
+"""
+
+
+def is_throttled(e):
+    if not isinstance(e, HttpError):
+        return False
+
+    if e.resp.status == 429:
+        return True
+
+    if e.resp.status != 403:
+        return False
+
+    try:
+        errors = json.loads(e.content.decode("utf-8"))["error"].get("errors", [])
+    except Exception:
+        return False
+
+    return any(err.get("reason") in RATE_LIMIT_REASONS for err in errors)
+
+
+""" seconds the server asked us to wait (Retry-After as seconds or as an http date), None if it did not say
+"""
+
+
+def retry_after(e):
+    if not isinstance(e, HttpError):
+        return None
+
+    value = e.resp.get("retry-after")
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value).timestamp()
+        return max(0.0, retry_at - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# http statuses worth another try
+RETRYABLE_STATUSES = [429, 500, 502, 503, 504]
+
+# 403 reasons drive/sheets use for going over a quota
+RATE_LIMIT_REASONS = ["rateLimitExceeded", "userRateLimitExceeded"]
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+import requests
+
+from helper.logger import *
+
+try:
+    import fcntl
+except ImportError:
+    # no inter-process locking where fcntl is not available, threads of one run are still serialized
+    fcntl = None
+
+
+class AssetStore(object):
+
+    """ content-addressed store of downloaded files (images, pdfs) shared by concurrent runs
+        objects are named by the hash of their source (url or drive id) and validator (ETag/Last-Modified or drive version),
+        index.json maps a source to its current object and validators
+    """
+
+    def __init__(self, store_dir, max_size_mb=2000, session=None):
+        self._store_dir = Path(store_dir)
+        self._objects_dir = self._store_dir / "objects"
+        self._objects_dir.mkdir(parents=True, exist_ok=True)
+        self._index_path = self._store_dir / "index.json"
+        self._lock_path = self._store_dir / "index.lock"
+        self._max_size = int(max_size_mb) * 1024 * 1024
+        self._session = session if session is not None else requests.Session()
+        self._lock = threading.Lock()
+        self._index = self.read_index()
+
+        # sources already validated in this run are not validated again, key'ed by source
+        self._validated = {}
+
+        # objects handed out in this run, the output refers to them so they are never evicted by this run
+        self._in_use = set()
+
+        # urls being fetched, key'ed by url - a concurrent fetch of the same url waits for the first one instead of downloading it again
+        self._in_flight = {}
+
+        # guards the three above, the prefetch pools fetch from many threads
+        self._state_lock = threading.Lock()
+
+    """ object for an url, revalidated (conditional GET) once per run, downloaded if it is new or changed
+    """
+
+    def fetch(self, url, ext, nesting_level=0):
+        with self._state_lock:
+            if url in self._validated:
+                return self._validated[url]
+
+            in_flight = self._in_flight.get(url)
+            fetching = in_flight is None
+            if fetching:
+                in_flight = Future()
+                self._in_flight[url] = in_flight
+
+        if not fetching:
+            return in_flight.result()
+
+        path = None
+        try:
+            path = self.revalidate(url, ext, nesting_level=nesting_level)
+        finally:
+            with self._state_lock:
+                del self._in_flight[url]
+
+            in_flight.set_result(path)
+
+        return path
+
+    """ fetch an url - the stored copy if the server says it has not changed, a fresh download otherwise
+    """
+
+    def revalidate(self, url, ext, nesting_level=0):
+        entry = self.lookup(url)
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+
+            if entry.get("last-modified"):
+                headers["If-Modified-Since"] = entry["last-modified"]
+
+        try:
+            response = self._session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+        except Exception as e:
+            # offline or the server is down, what we have is better than nothing
+            if entry is not None:
+                warn(f"could not revalidate [{url}], using stored copy : {e}", nesting_level=nesting_level)
+                return self.stored_copy(entry)
+
+            warn(f"could not download : [{url}] : {e}", nesting_level=nesting_level)
+            return None
+
+        with response:
+            if response.status_code == 304 and entry is not None:
+                path = self.object_path(entry)
+                try:
+                    os.utime(path, None)
+                except FileNotFoundError:
+                    # evicted by a concurrent run since it was looked up, download it afresh
+                    self.forget(url, entry)
+                    return self.revalidate(url, ext, nesting_level=nesting_level)
+
+                with self._state_lock:
+                    self._in_use.add(path.name)
+                    self._validated[url] = path
+
+                debug(f"asset unchanged  : [{url}]", nesting_level=nesting_level)
+                return path
+
+            if not response.ok:
+                # throttled (429) or a server error, as when the server can not be reached
+                if entry is not None:
+                    warn(f"{response} could not revalidate [{url}], using stored copy", nesting_level=nesting_level)
+                    return self.stored_copy(entry)
+
+                warn(f"{response} could not download : [{url}]", nesting_level=nesting_level)
+                return None
+
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            entry = {
+                "object": self.object_name(url, f"{etag}|{last_modified}", ext),
+                "etag": etag,
+                "last-modified": last_modified,
+            }
+
+            def write_file(file_path):
+                with open(file_path, "wb") as handle:
+                    for block in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        handle.write(block)
+
+            path = self.store(url, entry, write_file)
+
+        with self._state_lock:
+            self._validated[url] = path
+
+        debug(f"asset downloaded : [{url}]", nesting_level=nesting_level)
+
+        return path
+
+    """ object for a versioned source (e.g. a drive file id with its modified time), None if that version is not stored
+    """
+
+    def get(self, key, version):
+        entry = self.lookup(key)
+        if entry is None or entry.get("version") != version:
+            return None
+
+        path = self.object_path(entry)
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            # evicted by a concurrent run in the meantime
+            return None
+
+        with self._state_lock:
+            self._in_use.add(path.name)
+
+        return path
+
+    """ the stored object of an entry when it could not be revalidated, None if it is gone
+    """
+
+    def stored_copy(self, entry):
+        path = self.object_path(entry)
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            # evicted by a concurrent run since it was looked up
+            return None
+
+        with self._state_lock:
+            self._in_use.add(path.name)
+
+        return path
+
+    """ store a version of a source, write_file(path) writes the content to the given path
+    """
+
+    def put(self, key, version, ext, write_file):
+        entry = {"object": self.object_name(key, version, ext), "version": version}
+
+        return self.store(key, entry, write_file)
+
+    """ index entry for a source if its object exists
+    """
+
+    def lookup(self, key):
+        entry = self._index.get(key)
+        if entry is None or not self.object_path(entry).exists():
+            return None
+
+        return entry
+
+    """ path of the object of an index entry
+    """
+
+    def object_path(self, entry):
+        return self._objects_dir / entry["object"]
+
+    """ object name - the hash of source and validator, with the extension that the consumers (PIL, pdf2image, odt) rely on
+    """
+
+    def object_name(self, key, validator, ext):
+        return hashlib.sha256(f"{key}|{validator}".encode("utf-8")).hexdigest() + ext
+
+    """ write an object (atomically) and record it in the index
+    """
+
+    def store(self, key, entry, write_file):
+        path = self.object_path(entry)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.part")
+        try:
+            write_file(tmp_path)
+
+            # atomic, a reader never sees a half written object, a concurrent writer of the same object writes the same content
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+        entry["size"] = path.stat().st_size
+        with self.locked():
+            with self._state_lock:
+                self._in_use.add(path.name)
+
+            index = self.read_index()
+            index[key] = entry
+            self.evict(index)
+            self.write_index(index)
+            self._index = index
+
+        return path
+
+    """ drop the index entry of a source whose object is gone
+    """
+
+    def forget(self, key, entry):
+        with self.locked():
+            index = self.read_index()
+            if index.get(key, {}).get("object") == entry["object"]:
+                del index[key]
+                self.write_index(index)
+
+            self._index = index
+
+    """ the index as stored on disk
+    """
+
+    def read_index(self):
+        if not self._index_path.exists():
+            return {}
+
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+
+        except Exception as e:
+            warn(f"asset index [{self._index_path}] is not readable, starting afresh : {e}")
+            return {}
+
+    """ write the index (atomically)
+    """
+
+    def write_index(self, index):
+        tmp_path = self._index_path.with_name(f"{self._index_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+
+        os.replace(tmp_path, self._index_path)
+
+    """ remove least recently used objects (and their index entries) until the store fits its size limit, must be called locked
+        objects this run has handed out are kept, and so are objects used lately (get and fetch touch them) which a concurrent run
+        may have looked up and not opened yet, the store may stay over its limit until a later run
+    """
+
+    def evict(self, index):
+        with self._state_lock:
+            in_use = set(self._in_use)
+
+        recently_used = time.time() - EVICT_GRACE_SECONDS
+        objects = []
+        for path in self._objects_dir.iterdir():
+            if path.suffix in [".part", ".tmp"]:
+                continue
+
+            try:
+                stat = path.stat()
+                objects.append((stat.st_mtime, stat.st_size, path))
+            except FileNotFoundError:
+                pass
+
+        total_size = sum(size for _, size, _ in objects)
+        evicted = []
+        for mtime, size, path in sorted(objects, key=lambda x: x[0]):
+            if total_size <= self._max_size:
+                break
+
+            if path.name in in_use or mtime > recently_used:
+                continue
+
+            try:
+                path.unlink()
+                evicted.append(path.name)
+                total_size = total_size - size
+                debug(f"asset evicted : [{path.name}]")
+            except FileNotFoundError:
+                pass
+
+        for key in [key for key, entry in index.items() if entry["object"] in evicted]:
+            del index[key]
+
+    """ lock held across threads of this run and across concurrent runs sharing the store
+    """
+
+    def locked(self):
+        return _StoreLock(self._lock, self._lock_path)
+
+
+class _StoreLock(object):
+
+    def __init__(self, thread_lock, lock_path):
+        self._thread_lock = thread_lock
+        self._lock_path = lock_path
+        self._lock_file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if fcntl is not None:
+            self._lock_file = open(self._lock_path, "a")
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+        self._thread_lock.release()
+
+
+# downloads are streamed to disk in blocks of this size
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# seconds to wait for a server to connect/send data
+DOWNLOAD_TIMEOUT = 60
+
+# objects used within this many seconds are not evicted, a concurrent run sharing the store may be about to open them
+EVICT_GRACE_SECONDS = 60 * 60
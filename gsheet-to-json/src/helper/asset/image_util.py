@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+import struct
+from pathlib import Path
+
+from PIL import Image
+
+from helper.logger import *
+
+
+'''
+    size and dpi of an image as {'size': (width, height), 'dpi': (dpi_x, dpi_y) or None}, None if it is not a readable image
+    read from the image header (PNG IHDR/pHYs, JPEG SOF/JFIF, GIF, WEBP), PIL is used only for what the header does not tell
+    results are memoized by path - the images probed are asset store objects (named by the hash of source and version) and pdf pages
+    (under a directory named by the hash of the pdf), a path never gets other content; not by mtime, the store touches objects on every use
+'''
+def probe_image(path):
+    path = Path(path)
+    key = str(path)
+    if key in _PROBE_CACHE:
+        return _PROBE_CACHE[key]
+
+    try:
+        with open(path, 'rb') as f:
+            result = probe_image_header(f)
+
+    except (OSError, struct.error):
+        result = None
+
+    if result is None:
+        result = probe_image_with_pil(path)
+
+    # a path that can not be read now may be readable later
+    if result is not None:
+        _PROBE_CACHE[key] = result
+
+    return result
+
+
+
+'''
+    size and dpi from the header of an image file, None if the format is not known or the header does not tell everything
+'''
+def probe_image_header(f):
+    head = f.read(32)
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return probe_png(f)
+
+    if head.startswith(b'\xff\xd8'):
+        return probe_jpeg(f)
+
+    if head[:6] in [b'GIF87a', b'GIF89a']:
+        width, height = struct.unpack('<HH', head[6:10])
+        return {'size': (width, height), 'dpi': None}
+
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return probe_webp(head)
+
+    return None
+
+
+
+'''
+    PNG - size from IHDR, dpi from pHYs (only when the unit is meter, as PIL does)
+'''
+def probe_png(f):
+    f.seek(8)
+    size, dpi = None, None
+    while True:
+        chunk_header = f.read(8)
+        if len(chunk_header) < 8:
+            break
+
+        length, chunk_type = struct.unpack('>I4s', chunk_header)
+        if chunk_type == b'IHDR':
+            size = struct.unpack('>II', f.read(8))
+            f.seek(length - 8 + 4, 1)
+
+        elif chunk_type == b'pHYs':
+            px, py, unit = struct.unpack('>IIB', f.read(9))
+            if unit == 1:
+                dpi = (px * 0.0254, py * 0.0254)
+
+            f.seek(length - 9 + 4, 1)
+
+        # pHYs must come before the image data
+        elif chunk_type in [b'IDAT', b'IEND']:
+            break
+
+        else:
+            f.seek(length + 4, 1)
+
+    if size is None:
+        return None
+
+    return {'size': size, 'dpi': dpi}
+
+
+
+'''
+    JPEG - size from the SOF segment, dpi from the JFIF APP0 segment
+    if there is no JFIF density but there is EXIF, PIL takes the dpi from EXIF - let it do that
+'''
+def probe_jpeg(f):
+    f.seek(2)
+    size, dpi, has_exif = None, None, False
+    while size is None:
+        b = f.read(1)
+        if len(b) == 0:
+            return None
+
+        if b != b'\xff':
+            continue
+
+        marker = f.read(1)
+        while marker == b'\xff':
+            marker = f.read(1)
+
+        if len(marker) == 0:
+            return None
+
+        marker = marker[0]
+
+        # markers without a segment
+        if marker == 0x01 or 0xd0 <= marker <= 0xd7:
+            continue
+
+        # end of image/start of scan before a frame header, give up
+        if marker in [0xd9, 0xda]:
+            return None
+
+        length = struct.unpack('>H', f.read(2))[0]
+        segment = f.read(length - 2)
+
+        if marker == 0xe0 and segment.startswith(b'JFIF\x00') and len(segment) >= 12:
+            unit, density_x, density_y = struct.unpack('>BHH', segment[7:12])
+            if density_x and density_y:
+                if unit == 1:
+                    dpi = (float(density_x), float(density_y))
+
+                elif unit == 2:
+                    # 1 dpcm = 2.54 dpi
+                    dpi = (density_x * 2.54, density_y * 2.54)
+
+        elif marker == 0xe1 and segment.startswith(b'Exif\x00\x00'):
+            has_exif = True
+
+        # SOF0..SOF15 except DHT, JPG and DAC
+        elif 0xc0 <= marker <= 0xcf and marker not in [0xc4, 0xc8, 0xcc]:
+            height, width = struct.unpack('>HH', segment[1:5])
+            size = (width, height)
+
+    if dpi is None and has_exif:
+        return None
+
+    return {'size': size, 'dpi': dpi}
+
+
+
+'''
+    WEBP - size from the VP8X/VP8/VP8L chunk, WEBP carries no dpi
+'''
+def probe_webp(head):
+    chunk_type = head[12:16]
+    if chunk_type == b'VP8X':
+        width = 1 + int.from_bytes(head[24:27], 'little')
+        height = 1 + int.from_bytes(head[27:30], 'little')
+
+    elif chunk_type == b'VP8 ' and head[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', head[26:30])
+        width, height = width & 0x3fff, height & 0x3fff
+
+    elif chunk_type == b'VP8L' and head[20] == 0x2f:
+        bits = int.from_bytes(head[21:25], 'little')
+        width = 1 + (bits & 0x3fff)
+        height = 1 + ((bits >> 14) & 0x3fff)
+
+    else:
+        return None
+
+    return {'size': (width, height), 'dpi': None}
+
+
+
+'''
+    size and dpi through PIL, the file is closed as soon as the header is read
+'''
+def probe_image_with_pil(path):
+    try:
+        with Image.open(path) as im:
+            dpi = None
+            if 'dpi' in im.info:
+                # dpi values are of type IFDRational which is not JSON serializable, cast them to float
+                dpi_x, dpi_y = im.info['dpi']
+                dpi = (float(dpi_x), float(dpi_y))
+
+            return {'size': im.size, 'dpi': dpi}
+
+    except Exception as e:
+        warn(f"could not read image [{path}] : {e}")
+        return None
+
+
+
+# probe results key'ed by path
+_PROBE_CACHE = {}
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import threading
+from pathlib import Path
+
+import pdf2image
+
+from helper.logger import *
+
+
+'''
+    sha256 of the content of a file, memoized by (path, size, mtime)
+'''
+def file_hash(path):
+    path = Path(path)
+    stat = path.stat()
+    key = (str(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _HASH_CACHE:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(block)
+
+        _HASH_CACHE[key] = h.hexdigest()
+
+    return _HASH_CACHE[key]
+
+
+
+'''
+    page images of a pdf as {'pages': [paths], 'dpi': effective dpi}, rendered once per pdf content and raster options
+    into pages_root/<hash>-<options> and reused afterwards, pages are split across thread_count pdftoppm processes
+    options are dpi, format (png/jpeg), jpeg-quality and max-pixels (per page, the dpi is lowered to stay within it)
+'''
+def rasterize_pdf(pdf_path, pages_root, options, thread_count=1, nesting_level=0):
+    key = f"{file_hash(pdf_path)}-{options['dpi']}-{options['format']}-{options['jpeg-quality']}-{options['max-pixels']}"
+    pages_dir = Path(pages_root) / key
+
+    # one render per pdf at a time, a second caller waits and then finds the pages
+    with _render_lock(key):
+        page_list = read_page_list(pages_dir)
+        if page_list is not None:
+            debug(f"pdf pages existing   at: [{pages_dir}]", nesting_level=nesting_level)
+            return page_list
+
+        dpi = effective_dpi(pdf_path, options['dpi'], options['max-pixels'])
+        if options['format'] == 'jpeg':
+            format_args = {'fmt': 'jpeg', 'jpegopt': {'quality': options['jpeg-quality'], 'optimize': True, 'progressive': False}}
+        else:
+            format_args = {'fmt': 'png', 'transparent': True}
+
+        tmp_dir = Path(pages_root) / f"{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            images = pdf2image.convert_from_path(pdf_path, dpi=dpi, output_file='page', paths_only=True, output_folder=tmp_dir, thread_count=thread_count, **format_args)
+            with open(tmp_dir / PAGE_LIST_FILE, 'w', encoding='utf-8') as f:
+                json.dump({'dpi': dpi, 'pages': [Path(image).name for image in images]}, f)
+
+            # atomic, a concurrent run either sees all pages or none; if it rendered them first we keep its pages
+            try:
+                os.rename(tmp_dir, pages_dir)
+            except OSError:
+                pass
+
+        finally:
+            if tmp_dir.exists():
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        debug(f"pdf pages rendered   at: [{pages_dir}] ({dpi} dpi)", nesting_level=nesting_level)
+
+        return read_page_list(pages_dir)
+
+
+
+'''
+    the dpi to render at - the requested dpi, lowered so that a page (the first page's size) stays within max_pixels
+'''
+def effective_dpi(pdf_path, dpi, max_pixels):
+    if not max_pixels:
+        return dpi
+
+    # Page size looks like "595.276 x 841.89 pts (A4)"
+    m = re.match(r'\s*(?P<width>[0-9.]+)\s*x\s*(?P<height>[0-9.]+)\s*pts', str(pdf2image.pdfinfo_from_path(pdf_path).get('Page size', '')))
+    if not m:
+        return dpi
+
+    page_width_in_inches = float(m.group('width')) / 72
+    page_height_in_inches = float(m.group('height')) / 72
+    max_dpi = int(math.sqrt(max_pixels / (page_width_in_inches * page_height_in_inches)))
+
+    return max(1, min(dpi, max_dpi))
+
+
+
+'''
+    raster options for a pdf section - the defaults, overridden by the section's raster spec
+    a raster spec looks like "dpi=150, format=jpeg, jpeg-quality=80, max-pixels=4000000", unknown or invalid items are ignored
+'''
+def raster_options(defaults, raster_spec='', nesting_level=0):
+    options = dict(defaults)
+    if not isinstance(raster_spec, str) or raster_spec.strip() == '':
+        return options
+
+    for item in re.split('[,;]', raster_spec):
+        if item.strip() == '':
+            continue
+
+        key, _, value = item.partition('=')
+        key, value = key.strip().lower(), value.strip().lower()
+        try:
+            if key in ['dpi', 'jpeg-quality', 'max-pixels']:
+                options[key] = int(value)
+
+            elif key == 'format' and value in ['png', 'jpeg', 'jpg']:
+                options[key] = 'jpeg' if value == 'jpg' else value
+
+            else:
+                raise ValueError(value)
+
+        except ValueError:
+            warn(f"raster spec item [{item.strip()}] ignored", nesting_level=nesting_level)
+
+    return options
+
+
+
+'''
+    page list of a rendered pdf as {'pages': [paths], 'dpi': dpi}, None if it is not (completely) rendered
+'''
+def read_page_list(pages_dir):
+    page_list_path = Path(pages_dir) / PAGE_LIST_FILE
+    if not page_list_path.exists():
+        return None
+
+    with open(page_list_path, 'r', encoding='utf-8') as f:
+        page_list = json.load(f)
+
+    return {'dpi': page_list['dpi'], 'pages': [str(Path(pages_dir) / name) for name in page_list['pages']]}
+
+
+
+def _render_lock(key):
+    with _RENDER_LOCKS_LOCK:
+        if key not in _RENDER_LOCKS:
+            _RENDER_LOCKS[key] = threading.Lock()
+
+        return _RENDER_LOCKS[key]
+
+
+
+# raster options when neither the configuration nor the section says otherwise
+RASTER_DEFAULTS = {'dpi': 72, 'format': 'png', 'jpeg-quality': 85, 'max-pixels': None}
+
+# the page list is written last, its presence means the pages are complete
+PAGE_LIST_FILE = 'pages.json'
+
+# content hashes key'ed by (path, size, mtime)
+_HASH_CACHE = {}
+
+# one lock per pdf render key
+_RENDER_LOCKS = {}
+_RENDER_LOCKS_LOCK = threading.Lock()
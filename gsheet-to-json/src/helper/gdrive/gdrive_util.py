@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 
 from helper.logger import *
+from helper.api_scheduler import ApiScheduler, is_retryable
 
 from googleapiclient import errors
+from googleapiclient.http import MediaIoBaseDownload
 
 def copy_drive_file(service, origin_file_id, copy_title, nesting_level):
     """
@@ -25,19 +27,145 @@ def copy_drive_file(service, origin_file_id, copy_title, nesting_level):
 
 
 def download_drive_file(param, destination, context, nesting_level):
-    f = context['drive'].CreateFile(param)
-    f.GetContentFile(destination)
+    download_drive_content(context['drive-service'], param['id'], destination)
 
 
-def read_drive_file(drive_url, context, nesting_level):
+def read_drive_file(drive_url, context, nesting_level, http=None):
     url = drive_url.strip()
 
-    id = url.replace('https://drive.google.com/file/d/', '')
-    id = id.split('/')[0]
+    id = drive_file_id_from_url(url)
     # debug(f"drive file id to be read from is {id}", nesting_level=nesting_level)
-    f = context['drive'].CreateFile({'id': id})
-    if f['mimeType'] != 'text/plain':
-        warn(f"drive url {url} mime-type is {f['mimeType']} which may not be readable as text", nesting_level=nesting_level)
 
-    text = f.GetContentString()
-    return text
+    # metadata may already be there from a batch lookup, then the content is all we need to fetch
+    metadata = context.get('drive-metadata', {}).get(id)
+    if metadata is None:
+        metadata = get_drive_file_metadata(context['drive-service'], id, http=http)
+
+    if metadata['mimeType'] != 'text/plain':
+        warn(f"drive url {url} mime-type is {metadata['mimeType']} which may not be readable as text", nesting_level=nesting_level)
+
+    # the content is downloaded only when drive reports a version the asset store does not have
+    asset_store = context['asset-store']
+    key = f"drive:{id}"
+    version = f"{metadata.get('modifiedDate')}|{metadata.get('version')}"
+    local_path = asset_store.get(key, version)
+    if local_path is None:
+        local_path = asset_store.put(key, version, '.txt', lambda file_path: download_drive_content(context['drive-service'], id, file_path, http=http))
+
+    with open(local_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def drive_file_id_from_url(url):
+    id = url.strip().replace('https://drive.google.com/file/d/', '')
+    return id.split('/')[0]
+
+
+def get_drive_metadata(service, file_ids, http=None, nesting_level=0):
+    """
+    Get metadata of drive files through batch requests, at most 100 files per batch.
+
+    Args:
+        service: Drive (v3) API service instance.
+        file_ids: IDs of the files.
+
+    Returns:
+        A dict key'ed by file id, values as returned by drive_metadata_from_response.
+        Files that could not be looked up are not in the dict.
+    """
+    metadata = {}
+    failed = []
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            # a transient failure of one call in the batch does not fail the batch, it is retried on its own
+            if is_retryable(exception):
+                failed.append(request_id)
+            else:
+                warn(f"could not get metadata for drive file id = [{request_id}] : {exception}", nesting_level=nesting_level)
+            return
+
+        metadata[request_id] = drive_metadata_from_response(response)
+
+    def execute_batch(batch_file_ids):
+        failed.clear()
+        batch = service.new_batch_http_request(callback=callback)
+        for file_id in batch_file_ids:
+            batch.add(service.files().get(fileId=file_id, fields=DRIVE_METADATA_FIELDS, supportsAllDrives=True), request_id=file_id)
+
+        batch.execute(http=http)
+
+    for i in range(0, len(file_ids), DRIVE_BATCH_SIZE):
+        batch_file_ids = file_ids[i:i + DRIVE_BATCH_SIZE]
+        # every call in a batch counts against the quota
+        ApiScheduler().call('drive', lambda: execute_batch(batch_file_ids), cost=len(batch_file_ids), nesting_level=nesting_level)
+
+        for file_id in list(failed):
+            try:
+                metadata[file_id] = get_drive_file_metadata(service, file_id, http=http)
+            except Exception as e:
+                warn(f"could not get metadata for drive file id = [{file_id}] : {e}", nesting_level=nesting_level)
+
+    return metadata
+
+
+def get_drive_file_metadata(service, file_id, http=None):
+    """
+    Get metadata of a drive file.
+
+    Args:
+        service: Drive (v3) API service instance.
+        file_id: ID of the file.
+
+    Returns:
+        The metadata as returned by drive_metadata_from_response.
+    """
+    request = service.files().get(fileId=file_id, fields=DRIVE_METADATA_FIELDS, supportsAllDrives=True)
+    response = ApiScheduler().execute('drive', request, http=http)
+    return drive_metadata_from_response(response)
+
+
+def drive_metadata_from_response(response):
+    """
+    Drive v2 style metadata (title, modifiedDate) from a drive v3 files.get response, which is what the rest of the code uses.
+    """
+    return {
+        'id': response['id'],
+        'title': response['name'],
+        'mimeType': response['mimeType'],
+        'modifiedDate': response.get('modifiedTime'),
+        'version': response.get('version'),
+        'fileSize': response.get('size'),
+    }
+
+
+def download_drive_content(service, file_id, destination, http=None):
+    """
+    Download the content of a drive file into a local file, in chunks.
+
+    Args:
+        service: Drive (v3) API service instance.
+        file_id: ID of the file.
+        destination: path of the local file.
+        http: the (thread's own) authorized http to download with, the service's http if None.
+    """
+    request = service.files().get_media(fileId=file_id, supportsAllDrives=True)
+    if http is not None:
+        request.http = http
+
+    with open(destination, 'wb') as fd:
+        downloader = MediaIoBaseDownload(fd, request, chunksize=DRIVE_DOWNLOAD_CHUNK_SIZE)
+        done = False
+        while done is False:
+            # a failed chunk is retried, the download goes on from where it was
+            _, done = ApiScheduler().call('drive', downloader.next_chunk)
+
+
+# the metadata we need of a drive file
+DRIVE_METADATA_FIELDS = 'id,name,mimeType,modifiedTime,version,size'
+
+# drive downloads are done in chunks of this size
+DRIVE_DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# drive accepts at most 100 calls in a batch request
+DRIVE_BATCH_SIZE = 100
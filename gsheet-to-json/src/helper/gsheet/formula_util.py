@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+
+'''
+    a formula as the processors see it
+    kind is one of FORMULA_IMAGE, FORMULA_WORKSHEET_LINK, FORMULA_DRIVE_LINK, FORMULA_WEB_LINK, FORMULA_OTHER
+    image is the part inside =IMAGE(...), url/title are of a =HYPERLINK(url, title) (of any kind), gid is the #gid= of a worksheet link
+'''
+Formula = namedtuple('Formula', ['kind', 'image', 'url', 'title', 'gid'])
+
+
+
+'''
+    classify a formula (or any cell value) with one match per pattern at most, results are memoized as the same formula
+    tends to repeat across cells and worksheets
+'''
+@lru_cache(maxsize=8192)
+def classify_formula(value):
+    if not isinstance(value, str) or not value.startswith('='):
+        return OTHER_FORMULA
+
+    m = HYPERLINK_PATTERN.match(value)
+    if m:
+        url, title = m.group('link_url'), m.group('link_title')
+        if url[:5].lower() == '#gid=':
+            return Formula(FORMULA_WORKSHEET_LINK, None, url, title, url[5:])
+
+        if url.startswith('https://drive.google.com/file/d/'):
+            return Formula(FORMULA_DRIVE_LINK, None, url, title, None)
+
+        if url.startswith('http'):
+            return Formula(FORMULA_WEB_LINK, None, url, title, None)
+
+        return Formula(FORMULA_OTHER, None, url, title, None)
+
+    m = IMAGE_PATTERN.match(value)
+    if m:
+        return Formula(FORMULA_IMAGE, m.group('name'), None, None, None)
+
+    return OTHER_FORMULA
+
+
+
+# =IMAGE(...) and =HYPERLINK("url", "title"), case insensitive
+IMAGE_PATTERN = re.compile(r'=IMAGE\((?P<name>.+)\)', re.IGNORECASE)
+HYPERLINK_PATTERN = re.compile(r'=HYPERLINK\("(?P<link_url>.+)",\s*"(?P<link_title>.+)"\)', re.IGNORECASE)
+
+# formula kinds
+FORMULA_IMAGE = 'image'
+FORMULA_WORKSHEET_LINK = 'worksheet-link'
+FORMULA_DRIVE_LINK = 'drive-link'
+FORMULA_WEB_LINK = 'web-link'
+FORMULA_OTHER = 'other'
+
+OTHER_FORMULA = Formula(FORMULA_OTHER, None, None, None, None)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+import gzip
+import json
+import os
+import threading
+from pathlib import Path
+
+from helper.logger import *
+
+
+class GsheetCache(object):
+
+    """ on-disk cache of gsheet data, one gzip'ed json per gsheet key'ed by gsheet id
+        an entry is valid only for the version (drive modifiedTime/version) it was stored for
+    """
+
+    def __init__(self, cache_dir, max_size_mb=500, read=True, write=True):
+        self._cache_dir = Path(cache_dir)
+        self._cache_dir.mkdir(parents=True, exist_ok=True)
+        self._max_size = int(max_size_mb) * 1024 * 1024
+        self._read = read
+        self._write = write
+        self._lock = threading.Lock()
+
+    """ path of the cache file for a gsheet
+    """
+
+    def path(self, spreadsheet_id):
+        return self._cache_dir / f"{spreadsheet_id}.json.gz"
+
+    """ cached data if the cached version matches, None otherwise
+    """
+
+    def get(self, spreadsheet_id, version):
+        if not self._read:
+            return None
+
+        path = self.path(spreadsheet_id)
+        if not path.exists():
+            return None
+
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+
+        except Exception as e:
+            warn(f"gsheet cache entry [{path}] is not readable : {e}")
+            return None
+
+        if entry.get("version") != version:
+            return None
+
+        # touch it, eviction is least recently used first
+        os.utime(path, None)
+
+        return entry["data"]
+
+    """ store data for a version of a gsheet
+    """
+
+    def put(self, spreadsheet_id, version, data):
+        if not self._write:
+            return
+
+        path = self.path(spreadsheet_id)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump({"version": version, "data": data}, f)
+
+        # atomic, a reader never sees a half written entry
+        os.replace(tmp_path, path)
+
+        self.evict()
+
+    """ remove least recently used entries until the cache fits its size limit
+    """
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for path in self._cache_dir.glob("*.json.gz"):
+                try:
+                    stat = path.stat()
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                except FileNotFoundError:
+                    pass
+
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries, key=lambda x: x[0]):
+                if total_size <= self._max_size:
+                    break
+
+                try:
+                    path.unlink()
+                    total_size = total_size - size
+                    debug(f"gsheet cache entry evicted : [{path.name}]")
+                except FileNotFoundError:
+                    pass
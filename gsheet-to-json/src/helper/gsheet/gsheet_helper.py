@@ -1,16 +1,48 @@
 #!/usr/bin/env python3
 
-import sys
+import json
+import threading
+from collections import defaultdict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import httplib2
-import pygsheets
 from googleapiclient import discovery
+from helper.api_scheduler import ApiScheduler
+from helper.asset.asset_store import AssetStore
+from helper.asset.pdf_util import *
+from helper.gdrive.gdrive_util import *
+from helper.gsheet.gsheet_cache import GsheetCache
+from helper.gsheet.gsheet_plan import *
 from helper.gsheet.gsheet_reader import *
 from helper.gsheet.gsheet_util import *
 from helper.logger import *
 from oauth2client.service_account import ServiceAccountCredentials
-from pydrive2.auth import GoogleAuth
-from pydrive2.drive import GoogleDrive
+
+# the parts of a worksheet the json-to-* backends actually read, everything else is left out of masked reads
+WORKSHEET_FIELDS = (
+    "sheets(properties(sheetId,title,index,gridProperties),merges,"
+    "data(startRow,startColumn,rowMetadata(pixelSize),columnMetadata(pixelSize),"
+    "rowData(values(userEnteredValue,formattedValue,effectiveFormat,userEnteredFormat,textFormatRuns,note))))"
+)
+
+# just the worksheet titles, no grid data
+WORKSHEET_LIST_FIELDS = "sheets(properties(sheetId,title))"
+
+# what a plan (dry run) reads - the toc values of the index worksheet, and just the formulas of the worksheets it refers to, for
+# the images, text files and worksheets they link to
+PLAN_INDEX_FIELDS = "sheets(properties(title),data(rowData(values(userEnteredValue))))"
+PLAN_WORKSHEET_FIELDS = (
+    "sheets(properties(title),data(rowData(values(userEnteredValue(formulaValue)))))"
+)
+
+# the metadata we keep of a gsheet
+GSHEET_METADATA_FIELDS = "id,name,modifiedTime,version"
+
+# gsheet titles looked up in one drive files.list call, the query string has a length limit
+GSHEET_TITLES_PER_QUERY = 20
+
+# what processing needs to know of a gsheet
+Gsheet = namedtuple("Gsheet", ["id", "title"])
 
 
 class GsheetHelper(object):
@@ -36,9 +68,6 @@ class GsheetHelper(object):
 
         info(f"authorizing with Google")
 
-        _G = pygsheets.authorize(service_account_file=config["files"]["google-cred"])
-        self._context["_G"] = _G
-
         credentials = ServiceAccountCredentials.from_json_keyfile_name(
             config["files"]["google-cred"],
             scopes=[
@@ -46,95 +75,866 @@ class GsheetHelper(object):
                 "https://www.googleapis.com/auth/spreadsheets",
             ],
         )
-        credentials.authorize(httplib2.Http())
+        self._context["credentials"] = credentials
 
-        self._context["service"] = discovery.build(
-            "sheets", "v4", credentials=credentials
-        )
+        # sheets/drive calls are rate limited and retried as configured
+        ApiScheduler().init(config.get("api-scheduler", {}))
+
+        # one authorized http (one token, one connection) shared by the sheets and drive services on the main thread
+        http = credentials.authorize(httplib2.Http())
+        self._context["service"] = discovery.build("sheets", "v4", http=http)
 
-        gauth = GoogleAuth()
-        gauth.credentials = credentials
+        # drive v3 - title to id lookups, cheap metadata lookups (modifiedTime, version) and file downloads
+        self._context["drive-service"] = discovery.build("drive", "v3", http=http)
 
-        self._context["drive"] = GoogleDrive(gauth)
         self._context["tmp-dir"] = config["dirs"]["temp-dir"]
         self._context["index-worksheet"] = config["index-worksheet"]
-        self._context["gsheet-read-wait-seconds"] = config["gsheet-read-wait-seconds"]
-        self._context["gsheet-read-try-count"] = config["gsheet-read-try-count"]
         self._context["gsheet-data"] = {}
 
+        # ids of the gsheets being expanded (outermost first), expanded child gsheets key'ed by id and what the parent passes down,
+        # how many reads each linked gsheet has left
+        self._context["gsheet-stack"] = []
+        self._context["gsheet-expansions"] = {}
+        self._context["gsheet-expansion-uses"] = {}
+
+        # drive metadata of gsheets key'ed by gsheet id, gsheet ids key'ed by title
+        self._context["gsheet-metadata"] = {}
+        self._context["gsheet-ids"] = {}
+
+        # full - the whole gsheet with grid data in one call, masked - only the referenced worksheets with only the fields we use
+        self._context["gsheet-read-mode"] = config.get("gsheet-read-mode", "full")
+
+        # gsheet data is cached on disk and reused as long as the gsheet is not modified
+        cache_config = config.get("gsheet-cache", {})
+        if cache_config.get("enabled", True):
+            self._context["gsheet-cache"] = GsheetCache(
+                cache_dir=config["dirs"]["temp-dir"] / "gsheet-cache",
+                max_size_mb=cache_config.get("max-size-mb", 500),
+                read=not cache_config.get("refresh", False),
+            )
+        else:
+            self._context["gsheet-cache"] = None
+
+        # child gsheets are fetched ahead of processing through a bounded worker pool, key'ed by gsheet id
+        self._context["gsheet-fetch-workers"] = config.get("gsheet-fetch-workers", 8)
+        self._context["gsheet-prefetch"] = {}
+
+        # metadata of linked drive files, looked up in batches ahead of processing, key'ed by file id
+        self._context["drive-metadata"] = {}
+
+        # images (=IMAGE() formulas) are downloaded ahead of processing through a bounded worker pool sharing one pooled http session,
+        # with at most image-fetch-per-host downloads from one host at a time
+        self._context["image-fetch-workers"] = config.get("image-fetch-workers", 8)
+        self._context["image-fetch-per-host"] = config.get("image-fetch-per-host", 4)
+        self._context["http-session"] = new_http_session(
+            pool_size=max(self._context["image-fetch-workers"], 10)
+        )
+
+        # text files (drive/web) that HYPERLINK cells pull in are fetched this many at a time
+        self._context["text-fetch-workers"] = config.get("text-fetch-workers", 8)
+
+        # downloaded images and pdfs live in a content-addressed store that concurrent runs can share
+        self._context["asset-store"] = AssetStore(
+            store_dir=config["dirs"]["asset-dir"],
+            max_size_mb=config.get("asset-store", {}).get("max-size-mb", 2000),
+            session=self._context["http-session"],
+        )
+
+        # pdf pages are rendered once per pdf content (under temp-dir/pdf-pages), by pdf-raster.workers pdfs at a time,
+        # each split across pdf-raster.thread-count pdftoppm processes
+        # pdf-raster.dpi/format/jpeg-quality/max-pixels are the raster options of pdf sections unless a section says otherwise
+        raster_config = config.get("pdf-raster", {})
+        self._context["pdf-raster"] = dict(RASTER_DEFAULTS)
+        for key in RASTER_DEFAULTS.keys():
+            if key in raster_config:
+                self._context["pdf-raster"][key] = raster_config[key]
+
+        self._context["pdf-pages-dir"] = config["dirs"]["temp-dir"] / "pdf-pages"
+        self._context["pdf-raster-workers"] = raster_config.get("workers", 2)
+        self._context["pdf-raster-thread-count"] = raster_config.get("thread-count", 4)
+
+        # httplib2.Http is not thread-safe, every worker thread gets its own authorized http
+        self._thread_local = threading.local()
+
         self.current_document_index = -1
 
         info(f"authorized  with Google")
 
-    """ read the gsheet
+        # all configured gsheets are looked up by title at once
+        self.resolve_gsheet_ids(config.get("gsheets", []))
+
+    """ read the gsheet, sections are handed to section_writer (if given) as they are completed instead of being collected in the result
     """
 
-    def read_gsheet(self, gsheet_title, gsheet_url=None, parent=None, nesting_level=0):
-        wait_for = self._context["gsheet-read-wait-seconds"]
-        try_count = self._context["gsheet-read-try-count"]
-        gsheet = None
-        for i in range(0, try_count):
-            try:
-                if gsheet_url:
-                    gsheet_id = gsheet_id_from_url(
-                        url=gsheet_url, nesting_level=nesting_level
-                    )
-                    debug(
-                        f"opening gsheet id = {gsheet_id}", nesting_level=nesting_level
-                    )
-                    gsheet = self._context["_G"].open_by_url(gsheet_url)
+    def read_gsheet(
+        self,
+        gsheet_title,
+        gsheet_url=None,
+        parent=None,
+        section_writer=None,
+        nesting_level=0,
+    ):
+        # transient failures are retried (with backoff) by the api scheduler, what still fails here is fatal
+        try:
+            gsheet = self.open_gsheet(gsheet_title, gsheet_url, nesting_level)
+        except Exception as e:
+            error(
+                f"gsheet [{gsheet_title}] read request failed : {e}",
+                nesting_level=nesting_level,
+            )
+            raise
+
+        # a gsheet that links (directly or through its children) back to itself would be expanded forever
+        if gsheet.id in self._context["gsheet-stack"]:
+            chain = self._context["gsheet-stack"][
+                self._context["gsheet-stack"].index(gsheet.id) :
+            ] + [gsheet.id]
+            error(
+                f"gsheet link cycle, not expanded again : {self.gsheet_chain(chain)}",
+                nesting_level=nesting_level,
+            )
+            return {"sections": []}
+
+        # a child gsheet linked from more than one place is expanded once for each distinct way its parent shapes it, the expansion is
+        # kept only while the gsheet has links left to be read (see expansion_uses)
+        if parent is not None:
+            expansion_key = self.expansion_key(gsheet.id, parent)
+            uses = self._context["gsheet-expansion-uses"]
+            if gsheet.id in uses:
+                uses[gsheet.id] = uses[gsheet.id] - 1
+
+            expansions = self._context["gsheet-expansions"].get(gsheet.id, {})
+            if expansion_key in expansions:
+                debug(
+                    f"gsheet [{gsheet.title}] already expanded, reusing it",
+                    nesting_level=nesting_level,
+                )
+                data = expansions[expansion_key]
+                if uses.get(gsheet.id, 1) <= 0:
+                    del self._context["gsheet-expansions"][gsheet.id]
+
+                return self.restamp(data)
+
+        # the top level gsheet - fetch all linked gsheets (recursively) before processing starts
+        if parent is None:
+            # the worksheets table of this output, header/footer worksheets referenced by its sections; reused expansions refer to
+            # worksheets of this table, so they do not outlive it
+            self._context["worksheets"] = {}
+            self._context["gsheet-expansions"] = {}
+            self._context["gsheet-expansion-uses"] = {}
+
+            self.prefetch_gsheets(
+                self._context["gsheet-data"][gsheet.title], nesting_level=nesting_level
+            )
+            self.prefetch_drive_metadata(
+                [self._context["gsheet-data"][gsheet.title]]
+                + list(self._context["gsheet-prefetch"].values()),
+                nesting_level=nesting_level,
+            )
+            self.prefetch_images(
+                [self._context["gsheet-data"][gsheet.title]]
+                + list(self._context["gsheet-prefetch"].values()),
+                nesting_level=nesting_level,
+            )
+            self.prefetch_pdfs(
+                [self._context["gsheet-data"][gsheet.title]]
+                + list(self._context["gsheet-prefetch"].values()),
+                nesting_level=nesting_level,
+            )
+            links = self.link_graph(gsheet)
+            self.check_link_cycles(gsheet, links, nesting_level=nesting_level)
+            self._context["gsheet-expansion-uses"] = self.expansion_uses(
+                gsheet, links
+            )
+
+        self.current_document_index = self.current_document_index + 1
+        self._context["gsheet-stack"].append(gsheet.id)
+        try:
+            data = process_gsheet(
+                context=self._context,
+                gsheet=gsheet,
+                parent=parent,
+                current_document_index=self.current_document_index,
+                section_writer=section_writer,
+                nesting_level=nesting_level + 1,
+            )
+        finally:
+            self._context["gsheet-stack"].pop()
+
+        # a gsheet that is not in the link graph (not fetched ahead of processing) is kept, as far as we know it may be read again
+        if (
+            parent is not None
+            and self._context["gsheet-expansion-uses"].get(gsheet.id, 1) > 0
+        ):
+            self._context["gsheet-expansions"].setdefault(gsheet.id, {})[
+                expansion_key
+            ] = data
+
+        # the worksheets table goes to the top level, after all sections
+        if parent is None:
+            self._context["gsheet-expansions"] = {}
+            self._context["gsheet-expansion-uses"] = {}
+            if section_writer is not None:
+                section_writer.write_worksheets(self._context["worksheets"])
+            else:
+                data["worksheets"] = self._context["worksheets"]
+
+        return data
+
+    """ the graph of gsheet links (index worksheet gsheet sections) from the gsheet and the gsheets fetched ahead of processing,
+        parent id -> child ids, once per link
+    """
+
+    def link_graph(self, gsheet):
+        gsheet_data = dict(self._context["gsheet-prefetch"])
+        gsheet_data[gsheet.id] = self._context["gsheet-data"][gsheet.title]
+
+        return {
+            parent_id: self.child_gsheet_ids(data)
+            for parent_id, data in gsheet_data.items()
+        }
+
+    """ report the cycles in the graph of gsheet links reachable from a gsheet, as far as the gsheets were fetched ahead of processing;
+        a cycle is not expanded at processing time either way
+    """
+
+    def check_link_cycles(self, gsheet, links, nesting_level=0):
+        # depth first, a link to a gsheet that is still on the path closes a cycle
+        reported, path, done = set(), [], set()
+
+        def visit(parent_id):
+            path.append(parent_id)
+            for child_id in links.get(parent_id, []):
+                if child_id in path:
+                    cycle = path[path.index(child_id) :]
+                    if frozenset(cycle) not in reported:
+                        reported.add(frozenset(cycle))
+                        error(
+                            f"gsheet link cycle : {self.gsheet_chain(cycle + [child_id])}",
+                            nesting_level=nesting_level,
+                        )
+
+                elif child_id not in done:
+                    visit(child_id)
+
+            path.pop()
+            done.add(parent_id)
+
+        visit(gsheet.id)
+
+    """ how many times each linked gsheet will be read while the gsheet is processed - every link is read, the children of a gsheet
+        only on its first read (later reads reuse the expansion); a gsheet read once is not kept for reuse, the others are kept until
+        their last read. A gsheet linked from parents that shape it differently is read (and its children counted) more often than
+        this says, its expansion is then dropped early and expanded afresh, which costs time but not correctness
+    """
+
+    def expansion_uses(self, gsheet, links):
+        uses = {}
+
+        def visit(parent_id, path):
+            for child_id in links.get(parent_id, []):
+                if child_id in path:
+                    continue
+
+                uses[child_id] = uses.get(child_id, 0) + 1
+                if uses[child_id] == 1:
+                    visit(child_id, path + [child_id])
+
+        visit(gsheet.id, [gsheet.id])
+
+        return uses
+
+    """ a chain of gsheet ids as their titles (where known) for messages
+    """
+
+    def gsheet_chain(self, gsheet_ids):
+        return " -> ".join(
+            [
+                f"[{self._context['gsheet-metadata'].get(gsheet_id, {}).get('name', gsheet_id)}]"
+                for gsheet_id in gsheet_ids
+            ]
+        )
+
+    """ what a child gsheet's expansion depends on besides the gsheet itself - the parent's page-spec/margin-spec, header/footer overrides
+        and headers/footers (references, cheap to compare), and the nesting level
+    """
+
+    def expansion_key(self, gsheet_id, parent):
+        parent_prop = parent["section-prop"]
+        shaped_by = {
+            "nesting-level": parent["section-meta"]["nesting-level"],
+            "page-spec": parent_prop["page-spec"],
+            "margin-spec": parent_prop["margin-spec"],
+            "override-header": parent_prop["override-header"],
+            "override-footer": parent_prop["override-footer"],
+            "different-firstpage": parent_prop["different-firstpage"],
+        }
+        for slot in HEADER_FOOTER_SLOTS:
+            shaped_by[slot] = parent.get(slot)
+
+        return f"{gsheet_id}|{json.dumps(shaped_by, sort_keys=True, default=str)}"
+
+    """ a reused expansion as a new document - sections are copied with the next document index (and a fingerprint that follows it),
+        nested gsheets are renumbered in the order a fresh expansion would have numbered them
+    """
+
+    def restamp(self, data):
+        self.current_document_index = self.current_document_index + 1
+        document_index = self.current_document_index
+
+        sections = []
+        for section_data in data["sections"]:
+            section_data = dict(section_data)
+            section_meta = dict(section_data["section-meta"])
+            section_meta["document-index"] = document_index
+            section_meta["fingerprint"] = derived_fingerprint(
+                section_meta["fingerprint"], document_index
+            )
+            section_data["section-meta"] = section_meta
+
+            if section_data["section-prop"]["content-type"] == "gsheet" and isinstance(
+                section_data.get("contents"), dict
+            ):
+                section_data["contents"] = self.restamp(section_data["contents"])
+
+            sections.append(section_data)
+
+        return dict(data, sections=sections)
+
+    """ the plan of a build of the gsheet (a dry run) - the tree of the gsheets linked (recursively) from index worksheets, their sections
+        and worksheets and the images, pdfs and text files those pull in, with the api calls and bytes a build would cost; only the index
+        worksheets and the formulas of the worksheets they refer to are read, nothing is downloaded
+    """
+
+    def plan_gsheet(self, gsheet_title, nesting_level=0):
+        gsheet_id = self.resolve_gsheet_ids(
+            [gsheet_title], nesting_level=nesting_level
+        ).get(gsheet_title)
+        if gsheet_id is None:
+            raise Exception(f"gsheet [{gsheet_title}] not found")
+
+        plan_data = {}
+        tree = self.plan_node(gsheet_id, plan_data, [], nesting_level=nesting_level)
+
+        # sizes and versions of the linked drive files, looked up in batches for the whole tree
+        self.prefetch_drive_metadata(
+            list(plan_data.values()), nesting_level=nesting_level
+        )
+
+        return {
+            "tree": tree,
+            "lines": plan_lines(
+                tree, self._context["drive-metadata"], self._context["asset-store"]
+            ),
+            "estimate": plan_estimate(
+                tree,
+                self._context["drive-metadata"],
+                self._context["asset-store"],
+                ApiScheduler(),
+            ),
+        }
+
+    """ the plan of a gsheet and (recursively) of the gsheets its index links to, a gsheet is planned once - a later link to it is
+        marked as a repeat and a link back to a gsheet being planned as a cycle
+    """
+
+    def plan_node(self, gsheet_id, plan_data, stack, nesting_level=0):
+        metadata = self.get_gsheet_metadata(gsheet_id)
+        node = {
+            "id": gsheet_id,
+            "title": metadata["name"],
+            "repeat": gsheet_id in plan_data and gsheet_id not in stack,
+            "cycle": gsheet_id in stack,
+        }
+        if node["repeat"] or node["cycle"]:
+            return node
+
+        debug(f"planning gsheet [{node['title']}]", nesting_level=nesting_level)
+
+        # a cached gsheet costs a build no sheets call, and the plan is made from it
+        data = None
+        if self._context["gsheet-cache"] is not None:
+            data = self._context["gsheet-cache"].get(
+                gsheet_id, self.get_gsheet_version(gsheet_id)
+            )
+
+        if data is not None:
+            node["read"] = "cached"
+        else:
+            node["read"] = self._context["gsheet-read-mode"]
+            data = self.get_gsheet_data_masked(
+                gsheet_id,
+                index_fields=PLAN_INDEX_FIELDS,
+                worksheet_fields=PLAN_WORKSHEET_FIELDS,
+            )
+
+        plan_data[gsheet_id] = data
+
+        index_worksheet = self._context["index-worksheet"]
+        ws_titles, missing, rounds = plan_worksheets(data, index_worksheet)
+        if node["read"] == "cached":
+            node["sheets-calls"] = 0
+        elif node["read"] == "masked":
+            # the worksheet list, the index worksheet, then a call per round of referenced worksheets
+            node["sheets-calls"] = 2 + rounds if index_worksheet in data else 1
+        else:
+            node["sheets-calls"] = 1
+
+        if index_worksheet not in data:
+            warn(
+                f"index worksheet [{index_worksheet}] not found in gsheet [{node['title']}]",
+                nesting_level=nesting_level,
+            )
+
+        node["sections"] = plan_sections(get_toc_list(data.get(index_worksheet)))
+        node["worksheets"] = {
+            ws_title: plan_worksheet(data[ws_title]) for ws_title in ws_titles
+        }
+        node["missing-worksheets"] = missing
+
+        stack.append(gsheet_id)
+        for section in node["sections"]:
+            if section["content-type"] == "gsheet" and section["link-target"]:
+                section["gsheet"] = self.plan_node(
+                    gsheet_id_from_url(
+                        url=section["link-target"], nesting_level=nesting_level
+                    ),
+                    plan_data,
+                    stack,
+                    nesting_level=nesting_level + 1,
+                )
+
+        stack.pop()
+
+        return node
+
+    """ open a gsheet by url or title and read its data, unless it was already fetched ahead of processing
+    """
+
+    def open_gsheet(self, gsheet_title, gsheet_url=None, nesting_level=0):
+        if gsheet_url:
+            gsheet_id = gsheet_id_from_url(url=gsheet_url, nesting_level=nesting_level)
+        else:
+            gsheet_id = self.resolve_gsheet_ids(
+                [gsheet_title], nesting_level=nesting_level
+            ).get(gsheet_title)
+            if gsheet_id is None:
+                raise Exception(f"gsheet [{gsheet_title}] not found")
+
+        # the title as it is in drive, for a linked gsheet gsheet_title is just the link text
+        debug(f"opening gsheet id = {gsheet_id}", nesting_level=nesting_level)
+        metadata = self.get_gsheet_metadata(gsheet_id)
+        gsheet = Gsheet(id=gsheet_id, title=metadata["name"])
+        debug(f"opened  gsheet : [{gsheet.title}]", nesting_level=nesting_level)
+
+        # optimization - read the full gsheet, unless it was already fetched ahead of processing
+        if gsheet.id in self._context["gsheet-prefetch"]:
+            self._context["gsheet-data"][gsheet.title] = self._context[
+                "gsheet-prefetch"
+            ][gsheet.id]
+        else:
+            debug(f"reading gsheet : [{gsheet.title}]", nesting_level=nesting_level)
+            self._context["gsheet-data"][gsheet.title] = self.get_gsheet_data(gsheet.id)
+            debug(f"read    gsheet : [{gsheet.title}]", nesting_level=nesting_level)
+
+        return gsheet
+
+    """ fetch all gsheets linked (recursively) from the index worksheet of the given gsheet through a bounded worker pool
+    """
+
+    def prefetch_gsheets(self, gsheet_data, nesting_level=0):
+        workers = self._context["gsheet-fetch-workers"]
+        if workers <= 1:
+            return
+
+        submitted = set(self._context["gsheet-prefetch"].keys())
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for gsheet_id in self.child_gsheet_ids(gsheet_data):
+                if gsheet_id not in submitted:
+                    submitted.add(gsheet_id)
+                    futures[executor.submit(self.get_gsheet_data, gsheet_id)] = gsheet_id
+
+            if len(futures):
+                info(
+                    f"fetching linked gsheets with {workers} workers",
+                    nesting_level=nesting_level,
+                )
+
+            # as a gsheet arrives, its own children are queued right away
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    gsheet_id = futures.pop(future)
+                    try:
+                        data = future.result()
+                    except Exception as e:
+                        # not fatal, the gsheet will be read again (with retries) when it is processed
+                        warn(e)
+                        warn(
+                            f"could not fetch gsheet id = {gsheet_id} ahead of processing",
+                            nesting_level=nesting_level,
+                        )
+                        continue
+
+                    self._context["gsheet-prefetch"][gsheet_id] = data
                     debug(
-                        f"opened  gsheet id = {gsheet_id}", nesting_level=nesting_level
+                        f"fetched gsheet id = {gsheet_id}", nesting_level=nesting_level
                     )
-                else:
-                    debug(
-                        f"opening gsheet : [{gsheet_title}]",
+
+                    for child_gsheet_id in self.child_gsheet_ids(data):
+                        if child_gsheet_id not in submitted:
+                            submitted.add(child_gsheet_id)
+                            futures[
+                                executor.submit(self.get_gsheet_data, child_gsheet_id)
+                            ] = child_gsheet_id
+
+    """ look up (in batches) metadata of all drive files the gsheets link to - pdf sections and text files in hyperlinks
+    """
+
+    def prefetch_drive_metadata(self, gsheet_data_list, nesting_level=0):
+        file_ids = []
+        for gsheet_data in gsheet_data_list:
+            urls = []
+            for toc in get_toc_list(gsheet_data.get(self._context["index-worksheet"])):
+                if toc[4] == "pdf":
+                    _, link_target = get_gsheet_link(toc[5])
+                    urls.append(link_target)
+
+            for worksheet_data in gsheet_data.values():
+                urls = urls + get_hyperlinks(worksheet_data)
+
+            for url in urls:
+                if isinstance(url, str) and url.startswith(
+                    "https://drive.google.com/file/d/"
+                ):
+                    file_id = drive_file_id_from_url(url)
+                    if (
+                        file_id not in file_ids
+                        and file_id not in self._context["drive-metadata"]
+                    ):
+                        file_ids.append(file_id)
+
+        if len(file_ids) == 0:
+            return
+
+        info(
+            f"looking up metadata of {len(file_ids)} drive files",
+            nesting_level=nesting_level,
+        )
+        try:
+            self._context["drive-metadata"].update(
+                get_drive_metadata(
+                    self._context["drive-service"],
+                    file_ids,
+                    nesting_level=nesting_level,
+                )
+            )
+        except Exception as e:
+            # not fatal, the files will be looked up one by one when they are downloaded
+            warn(
+                f"drive metadata batch lookup failed : {e}", nesting_level=nesting_level
+            )
+
+    """ download the images of all =IMAGE() formulas in the gsheets through a bounded worker pool, the table processor then finds them on disk
+    """
+
+    def prefetch_images(self, gsheet_data_list, nesting_level=0):
+        workers = self._context["image-fetch-workers"]
+        if workers <= 1:
+            return
+
+        downloads = {}
+        for gsheet_data in gsheet_data_list:
+            for worksheet_data in gsheet_data.values():
+                for image_formula in get_image_formulas(worksheet_data):
+                    url = image_url_from_formula(image_formula)
+                    ext = image_extension(url, nesting_level=nesting_level)
+                    if ext is not None:
+                        downloads[url] = ext
+
+        if len(downloads) == 0:
+            return
+
+        info(
+            f"fetching {len(downloads)} images with {workers} workers",
+            nesting_level=nesting_level,
+        )
+
+        per_host = self._context["image-fetch-per-host"]
+        host_slots = defaultdict(lambda: threading.BoundedSemaphore(per_host))
+        for url in downloads.keys():
+            host_slots[urllib3.util.parse_url(url).host]
+
+        def download(url, ext):
+            with host_slots[urllib3.util.parse_url(url).host]:
+                return self._context["asset-store"].fetch(
+                    url, ext, nesting_level=nesting_level
+                )
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(download, url, ext): url
+                for url, ext in downloads.items()
+            }
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    # not fatal, the image will be downloaded again when it is processed
+                    warn(
+                        f"could not download image [{futures[future]}] ahead of processing : {e}",
                         nesting_level=nesting_level,
                     )
-                    gsheet = self._context["_G"].open(gsheet_title)
-                    debug(
-                        f"opened  gsheet : [{gsheet_title}]",
+
+    """ download the pdfs of all pdf sections and render their pages, several pdfs at a time, the pdf processor then finds the pages on disk
+    """
+
+    def prefetch_pdfs(self, gsheet_data_list, nesting_level=0):
+        workers = self._context["pdf-raster-workers"]
+        if workers <= 1:
+            return
+
+        pdf_sections = {}
+        for gsheet_data in gsheet_data_list:
+            for toc in get_toc_list(gsheet_data.get(self._context["index-worksheet"])):
+                if toc[4] == "pdf":
+                    _, link_target = get_gsheet_link(toc[5])
+                    options = raster_options(
+                        self._context["pdf-raster"], toc[25], nesting_level=nesting_level
+                    )
+                    pdf_sections[f"{link_target}|{options}"] = (link_target, options)
+
+        if len(pdf_sections) == 0:
+            return
+
+        info(
+            f"rendering {len(pdf_sections)} pdfs with {workers} workers",
+            nesting_level=nesting_level,
+        )
+
+        def render(pdf_url, options):
+            if pdf_url.startswith("https://drive.google.com/file/d/"):
+                data = download_file_from_drive(
+                    pdf_url,
+                    self._context["asset-store"],
+                    self._context["drive-service"],
+                    drive_metadata=self._context["drive-metadata"],
+                    http=self.get_http(),
+                    nesting_level=nesting_level,
+                )
+            elif pdf_url.startswith("http"):
+                data = download_file_from_web(
+                    pdf_url, self._context["asset-store"], nesting_level=nesting_level
+                )
+            else:
+                return
+
+            if data is not None and data["file-type"] == "application/pdf":
+                rasterize_pdf(
+                    data["file-path"],
+                    self._context["pdf-pages-dir"],
+                    options,
+                    thread_count=self._context["pdf-raster-thread-count"],
+                    nesting_level=nesting_level,
+                )
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(render, pdf_url, options): pdf_url
+                for pdf_url, options in pdf_sections.values()
+            }
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    # not fatal, the pdf will be rendered again when it is processed
+                    warn(
+                        f"could not render pdf [{futures[future]}] ahead of processing : {e}",
                         nesting_level=nesting_level,
                     )
 
-                # optimization - read the full gsheet
-                debug(f"reading gsheet : [{gsheet_title}]", nesting_level=nesting_level)
-                self._context["gsheet-data"][gsheet_title] = self.get_gsheet_data(
-                    gsheet
+    """ look up gsheet ids by title, several titles in one drive files.list call, titles already looked up are not looked up again
+    """
+
+    def resolve_gsheet_ids(self, gsheet_titles, nesting_level=0):
+        gsheet_ids = self._context["gsheet-ids"]
+        to_resolve = []
+        for gsheet_title in gsheet_titles:
+            if gsheet_title not in gsheet_ids and gsheet_title not in to_resolve:
+                to_resolve.append(gsheet_title)
+
+        for i in range(0, len(to_resolve), GSHEET_TITLES_PER_QUERY):
+            titles = to_resolve[i : i + GSHEET_TITLES_PER_QUERY]
+            names = " or ".join(
+                [
+                    "name='{}'".format(
+                        title.replace("\\", "\\\\").replace("'", "\\'")
+                    )
+                    for title in titles
+                ]
+            )
+            query = f"mimeType='application/vnd.google-apps.spreadsheet' and trashed=false and ({names})"
+
+            files = []
+            page_token = None
+            while True:
+                request = (
+                    self._context["drive-service"]
+                    .files()
+                    .list(
+                        q=query,
+                        fields=f"nextPageToken,files({GSHEET_METADATA_FIELDS})",
+                        supportsAllDrives=True,
+                        includeItemsFromAllDrives=True,
+                        pageToken=page_token,
+                    )
+                )
+                response = ApiScheduler().execute(
+                    "drive", request, http=self.get_http(), nesting_level=nesting_level
+                )
+                files = files + response.get("files", [])
+                page_token = response.get("nextPageToken")
+                if page_token is None:
+                    break
+
+            for f in files:
+                if f["name"] in gsheet_ids:
+                    if gsheet_ids[f["name"]] != f["id"]:
+                        warn(
+                            f"more than one gsheet named [{f['name']}], using id = {gsheet_ids[f['name']]}",
+                            nesting_level=nesting_level,
+                        )
+                    continue
+
+                gsheet_ids[f["name"]] = f["id"]
+                self._context["gsheet-metadata"][f["id"]] = f
+
+        return {
+            title: gsheet_ids[title] for title in gsheet_titles if title in gsheet_ids
+        }
+
+    """ drive metadata (name, modifiedTime, version) of a gsheet, looked up once
+    """
+
+    def get_gsheet_metadata(self, spreadsheet_id):
+        if spreadsheet_id not in self._context["gsheet-metadata"]:
+            request = (
+                self._context["drive-service"]
+                .files()
+                .get(
+                    fileId=spreadsheet_id,
+                    fields=GSHEET_METADATA_FIELDS,
+                    supportsAllDrives=True,
                 )
-                debug(f"read    gsheet : [{gsheet_title}]", nesting_level=nesting_level)
+            )
+            response = ApiScheduler().execute("drive", request, http=self.get_http())
+            self._context["gsheet-metadata"][spreadsheet_id] = response
 
-                break
+        return self._context["gsheet-metadata"][spreadsheet_id]
 
-            except Exception as e:
-                warn(e)
-                warn(
-                    f"gsheet {gsheet_title} read request (attempt {i}) failed, waiting for {wait_for} seconds before trying again",
-                    nesting_level=nesting_level,
+    """ text content of drive/web urls (of HYPERLINK cells) key'ed by url, fetched through a bounded worker pool, None for what could not be read
+    """
+
+    def fetch_texts(self, urls, nesting_level=0):
+        def fetch(url):
+            if url.startswith("https://drive.google.com/file/d/"):
+                return read_drive_file(
+                    url, self._context, nesting_level=nesting_level, http=self.get_http()
                 )
-                time.sleep(float(wait_for))
 
-        if gsheet is None:
-            error("gsheet read request failed, quiting", nesting_level=nesting_level)
-            sys.exit(1)
+            return read_web_content(
+                url, self._context["asset-store"], nesting_level=nesting_level
+            )
 
-        self.current_document_index = self.current_document_index + 1
-        data = process_gsheet(
-            context=self._context,
-            gsheet=gsheet,
-            parent=parent,
-            current_document_index=self.current_document_index,
-            nesting_level=nesting_level + 1,
-        )
+        texts = {}
+        workers = min(self._context["text-fetch-workers"], len(urls))
+        if workers <= 1:
+            for url in urls:
+                texts[url] = fetch(url)
+
+            return texts
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(fetch, url): url for url in urls}
+            for future in futures:
+                try:
+                    texts[futures[future]] = future.result()
+                except Exception as e:
+                    warn(
+                        f"could not read [{futures[future]}] : {e}",
+                        nesting_level=nesting_level,
+                    )
+                    texts[futures[future]] = None
 
-        return data
+        return texts
+
+    """ ids of the gsheets linked from the index worksheet of a gsheet, once per link
+    """
+
+    def child_gsheet_ids(self, gsheet_data):
+        gsheet_ids = []
+        toc_list = get_toc_list(gsheet_data.get(self._context["index-worksheet"]))
+        for toc in toc_list:
+            if toc[4] != "gsheet":
+                continue
+
+            _, link_target = get_gsheet_link(toc[5])
+            if link_target:
+                gsheet_ids.append(
+                    gsheet_id_from_url(url=link_target, nesting_level=0)
+                )
+
+        return gsheet_ids
+
+    """ authorized http for the current thread
+    """
+
+    def get_http(self):
+        if threading.current_thread() is threading.main_thread():
+            return None
+
+        if not hasattr(self._thread_local, "http"):
+            self._thread_local.http = self._context["credentials"].authorize(
+                httplib2.Http()
+            )
+
+        return self._thread_local.http
 
     """ get data from the gsheet
     """
 
-    def get_gsheet_data(self, gsheet):
-        # The spreadsheet to request.
-        spreadsheet_id = gsheet.id
+    def get_gsheet_data(self, spreadsheet_id):
+        cache = self._context["gsheet-cache"]
+        if cache is None:
+            return self.read_gsheet_data(spreadsheet_id)
+
+        # one cheap metadata call decides whether the cached data can be used
+        version = self.get_gsheet_version(spreadsheet_id)
+        data = cache.get(spreadsheet_id, version)
+        if data is not None:
+            debug(f"gsheet id = {spreadsheet_id} unchanged, using cached data")
+            return data
+
+        data = self.read_gsheet_data(spreadsheet_id)
+        cache.put(spreadsheet_id, version, data)
+
+        return data
+
+    """ version of the gsheet as known to drive, the read mode and index are part of it as they shape the data we keep
+    """
+
+    def get_gsheet_version(self, spreadsheet_id):
+        response = self.get_gsheet_metadata(spreadsheet_id)
+
+        return f"{response.get('modifiedTime')}|{response.get('version')}|{self._context['gsheet-read-mode']}|{self._context['index-worksheet']}"
+
+    """ read data from the gsheet through the sheets api
+    """
+
+    def read_gsheet_data(self, spreadsheet_id):
+        if self._context["gsheet-read-mode"] == "masked":
+            return self.get_gsheet_data_masked(spreadsheet_id)
 
         # The ranges to retrieve from the spreadsheet
         ranges = []
@@ -151,9 +951,72 @@ class GsheetHelper(object):
                 includeGridData=include_grid_data,
             )
         )
-        response = request.execute()
+        response = ApiScheduler().execute("sheets", request, http=self.get_http())
 
         # make a dictionary key'ed by worksheet_name
         response = {sheet["properties"]["title"]: sheet for sheet in response["sheets"]}
 
         return response
+
+    """ get data from the gsheet, only the worksheets that are referenced from the index worksheet (directly or through #gid= links)
+        and only the fields that are used later
+    """
+
+    def get_gsheet_data_masked(
+        self,
+        spreadsheet_id,
+        index_fields=WORKSHEET_FIELDS,
+        worksheet_fields=WORKSHEET_FIELDS,
+    ):
+        # worksheet titles, so that we never ask for a range that does not exist
+        ws_titles = [
+            sheet["properties"]["title"]
+            for sheet in self.get_worksheets(spreadsheet_id, WORKSHEET_LIST_FIELDS)
+        ]
+
+        response = {}
+        index_worksheet = self._context["index-worksheet"]
+        if index_worksheet not in ws_titles:
+            return response
+
+        for sheet in self.get_worksheets(
+            spreadsheet_id, index_fields, ranges=[worksheet_range(index_worksheet)]
+        ):
+            response[sheet["properties"]["title"]] = sheet
+
+        # worksheets referenced by sections and headers/footers, then whatever those link to, until nothing new is found
+        to_read = get_referenced_worksheets(get_toc_list(response[index_worksheet]))
+        while True:
+            to_read = [
+                ws_title
+                for ws_title in to_read
+                if ws_title in ws_titles and ws_title not in response
+            ]
+            if len(to_read) == 0:
+                break
+
+            sheets = self.get_worksheets(
+                spreadsheet_id,
+                worksheet_fields,
+                ranges=[worksheet_range(ws_title) for ws_title in to_read],
+            )
+
+            to_read = []
+            for sheet in sheets:
+                response[sheet["properties"]["title"]] = sheet
+                to_read = to_read + get_linked_worksheets(sheet)
+
+        return response
+
+    """ spreadsheets.get with a field mask
+    """
+
+    def get_worksheets(self, spreadsheet_id, fields, ranges=[]):
+        request = (
+            self._context["service"]
+            .spreadsheets()
+            .get(spreadsheetId=spreadsheet_id, ranges=ranges, fields=fields)
+        )
+        response = ApiScheduler().execute("sheets", request, http=self.get_http())
+
+        return response.get("sheets", [])
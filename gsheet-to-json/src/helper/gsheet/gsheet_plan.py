@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+import math
+
+from helper.logger import *
+from helper.gsheet.gsheet_util import *
+from helper.gdrive.gdrive_util import drive_file_id_from_url, DRIVE_DOWNLOAD_CHUNK_SIZE
+
+
+'''
+    the sections of a gsheet as a build would see them (links parsed as process_section parses them) from the toc rows of its index
+    worksheet, with the worksheets each section refers to (its table and its headers/footers)
+'''
+def plan_sections(toc_list):
+    sections = []
+    for toc in toc_list:
+        if toc[4] in ['gsheet', 'pdf']:
+            link_name, link_target = get_gsheet_link(toc[5])
+
+        elif toc[4] == 'table':
+            link_name, link_target = get_worksheet_link(toc[5]), None
+
+        else:
+            link_name, link_target = toc[5], None
+
+        sections.append({
+            'label'             : str(toc[0]),
+            'heading'           : toc[1],
+            'content-type'      : toc[4],
+            'link'              : link_name,
+            'link-target'       : link_target,
+            'background-image'  : str(toc[21]).strip(),
+            'worksheets'        : get_referenced_worksheets([toc]),
+            'gsheet'            : None,
+        })
+
+    return sections
+
+
+
+'''
+    the worksheets of a gsheet a build reads - those the index refers to, then whatever those link to (#gid=) until nothing new is found,
+    in the order a masked read reads them; also the referenced worksheets that are not in the gsheet and the number of masked read rounds
+'''
+def plan_worksheets(gsheet_data, index_worksheet):
+    ws_titles, missing, rounds = [], [], 0
+
+    to_read = get_referenced_worksheets(get_toc_list(gsheet_data.get(index_worksheet)))
+    while True:
+        for ws_title in to_read:
+            if ws_title not in gsheet_data and ws_title not in missing:
+                missing.append(ws_title)
+
+        to_read = [ws_title for ws_title in to_read if ws_title in gsheet_data and ws_title not in ws_titles and ws_title != index_worksheet]
+        if len(to_read) == 0:
+            break
+
+        rounds = rounds + 1
+        ws_titles = ws_titles + to_read
+
+        linked = []
+        for ws_title in to_read:
+            linked = linked + get_linked_worksheets(gsheet_data[ws_title])
+
+        to_read = list(dict.fromkeys(linked))
+
+    return ws_titles, missing, rounds
+
+
+
+'''
+    what a worksheet pulls in - urls of its images (=IMAGE()) and text files (drive/web =HYPERLINK()), and the worksheets it links to
+'''
+def plan_worksheet(worksheet_data):
+    return {
+        'images'        : list(dict.fromkeys([image_url_from_formula(image_formula) for image_formula in get_image_formulas(worksheet_data)])),
+        'texts'         : [url for url in get_hyperlinks(worksheet_data) if url.startswith('http')],
+        'worksheets'    : get_linked_worksheets(worksheet_data),
+    }
+
+
+
+'''
+    the gsheet nodes of a plan tree, each gsheet once (repeated and cyclic links are not nodes of their own)
+'''
+def plan_gsheets(node):
+    if node['repeat'] or node['cycle']:
+        return
+
+    yield node
+
+    for section in node['sections']:
+        if section['gsheet'] is not None:
+            yield from plan_gsheets(section['gsheet'])
+
+
+
+'''
+    the urls of the files a plan tree pulls in, each once - images, text files and pdfs
+'''
+def plan_files(node):
+    images, texts, pdfs = [], [], []
+    for gsheet_node in plan_gsheets(node):
+        for section in gsheet_node['sections']:
+            if section['background-image'] != '':
+                images.append(section['background-image'])
+
+            if section['content-type'] == 'pdf' and section['link-target']:
+                pdfs.append(section['link-target'])
+
+        for worksheet in gsheet_node['worksheets'].values():
+            images = images + worksheet['images']
+            texts = texts + worksheet['texts']
+
+    return list(dict.fromkeys(images)), list(dict.fromkeys(texts)), list(dict.fromkeys(pdfs))
+
+
+
+'''
+    what a build of the plan tree would cost - sheets/drive api calls, drive files and their bytes (from drive metadata), web files,
+    and the least time the calls take under the api scheduler's rate limits
+'''
+def plan_estimate(node, drive_metadata, asset_store, api_scheduler):
+    gsheet_nodes = list(plan_gsheets(node))
+    images, texts, pdfs = plan_files(node)
+
+    estimate = {
+        'gsheets'           : len(gsheet_nodes),
+        'cached-gsheets'    : len([gsheet_node for gsheet_node in gsheet_nodes if gsheet_node['read'] == 'cached']),
+        'worksheets'        : sum([len(gsheet_node['worksheets']) for gsheet_node in gsheet_nodes]),
+        'sheets-calls'      : sum([gsheet_node['sheets-calls'] for gsheet_node in gsheet_nodes]),
+        # the top level gsheet is looked up by title, every other gsheet by id
+        'drive-calls'       : len(gsheet_nodes),
+        'drive-files'       : 0,
+        'drive-bytes'       : 0,
+        'download-bytes'    : 0,
+        'unknown-sizes'     : 0,
+        'web-files'         : 0,
+        'stored-web-files'  : 0,
+        'stored-web-bytes'  : 0,
+    }
+
+    for url in images + texts + pdfs:
+        if url.startswith('https://drive.google.com/file/d/'):
+            file_id = drive_file_id_from_url(url)
+            metadata = drive_metadata.get(file_id)
+            estimate['drive-files'] = estimate['drive-files'] + 1
+            # one metadata lookup (batched, but every call in a batch counts)
+            estimate['drive-calls'] = estimate['drive-calls'] + 1
+            if metadata is None or metadata.get('fileSize') is None:
+                estimate['unknown-sizes'] = estimate['unknown-sizes'] + 1
+                estimate['drive-calls'] = estimate['drive-calls'] + 1
+                continue
+
+            size = int(metadata['fileSize'])
+            estimate['drive-bytes'] = estimate['drive-bytes'] + size
+            if not drive_file_stored(file_id, metadata, asset_store):
+                # downloaded in chunks, a call each
+                estimate['download-bytes'] = estimate['download-bytes'] + size
+                estimate['drive-calls'] = estimate['drive-calls'] + max(1, math.ceil(size / DRIVE_DOWNLOAD_CHUNK_SIZE))
+
+        elif url.startswith('http'):
+            estimate['web-files'] = estimate['web-files'] + 1
+            stored_size = web_file_stored_size(url, asset_store)
+            if stored_size is not None:
+                estimate['stored-web-files'] = estimate['stored-web-files'] + 1
+                estimate['stored-web-bytes'] = estimate['stored-web-bytes'] + stored_size
+
+    estimate['min-seconds'] = api_scheduler.min_seconds('sheets', estimate['sheets-calls']) + api_scheduler.min_seconds('drive', estimate['drive-calls'])
+
+    return estimate
+
+
+
+'''
+    the plan tree as indented lines - gsheets, their sections and worksheets, and the images, pdfs and text files those pull in
+'''
+def plan_lines(node, drive_metadata, asset_store, indent=0):
+    leader = PLAN_INDENT * indent
+    if node['cycle']:
+        return [f"{leader}gsheet [{node['title']}] id = {node['id']} : link cycle, not expanded"]
+
+    if node['repeat']:
+        return [f"{leader}gsheet [{node['title']}] id = {node['id']} : listed above"]
+
+    if node['read'] == 'cached':
+        lines = [f"{leader}gsheet [{node['title']}] id = {node['id']} : cached, no sheets calls"]
+    else:
+        lines = [f"{leader}gsheet [{node['title']}] id = {node['id']} : {node['read']} read, {node['sheets-calls']} sheets calls"]
+
+    leader = PLAN_INDENT * (indent + 1)
+    for section in node['sections']:
+        line = f"{leader}{section['label']} [{section['content-type']}] {section['heading']}"
+        if section['content-type'] == 'table':
+            line = f"{line} : worksheet [{section['link']}]"
+
+        elif section['content-type'] == 'pdf':
+            line = f"{line} : pdf {describe_file(section['link-target'], drive_metadata, asset_store)}"
+
+        elif section['content-type'] == 'gsheet':
+            line = f"{line} : [{section['link']}]"
+
+        lines.append(line)
+
+        if section['background-image'] != '':
+            lines.append(f"{leader}{PLAN_INDENT}background image {describe_file(section['background-image'], drive_metadata, asset_store)}")
+
+        if section['gsheet'] is not None:
+            lines = lines + plan_lines(section['gsheet'], drive_metadata, asset_store, indent=indent + 2)
+
+    for ws_title, worksheet in node['worksheets'].items():
+        lines.append(f"{leader}worksheet [{ws_title}]")
+        for url in worksheet['images']:
+            lines.append(f"{leader}{PLAN_INDENT}image {describe_file(url, drive_metadata, asset_store)}")
+
+        for url in worksheet['texts']:
+            lines.append(f"{leader}{PLAN_INDENT}text  {describe_file(url, drive_metadata, asset_store)}")
+
+        for linked_ws_title in worksheet['worksheets']:
+            lines.append(f"{leader}{PLAN_INDENT}link  worksheet [{linked_ws_title}]")
+
+    for ws_title in node['missing-worksheets']:
+        lines.append(f"{leader}worksheet [{ws_title}] : not in the gsheet")
+
+    return lines
+
+
+
+'''
+    the estimate as lines
+'''
+def estimate_lines(estimate):
+    return [
+        f"gsheets    : {estimate['gsheets']} ({estimate['cached-gsheets']} cached), {estimate['worksheets']} worksheets",
+        f"sheets api : {estimate['sheets-calls']} calls",
+        f"drive api  : {estimate['drive-calls']} calls",
+        f"drive      : {estimate['drive-files']} files, {format_size(estimate['drive-bytes'])}, {format_size(estimate['download-bytes'])} to download" + (f", {estimate['unknown-sizes']} of unknown size" if estimate['unknown-sizes'] else ''),
+        f"web        : {estimate['web-files']} files, {estimate['stored-web-files']} stored ({format_size(estimate['stored-web-bytes'])}) to be revalidated, the rest to download",
+        f"rate limit : at least {estimate['min-seconds']:.0f} seconds of api calls",
+    ]
+
+
+
+'''
+    a linked file for the plan - its url, drive name and size, and whether the asset store already has it
+'''
+def describe_file(url, drive_metadata, asset_store):
+    if not url:
+        return '[]'
+
+    if url.startswith('https://drive.google.com/file/d/'):
+        file_id = drive_file_id_from_url(url)
+        metadata = drive_metadata.get(file_id)
+        if metadata is None:
+            return f"[{url}] drive, metadata not found"
+
+        size = format_size(int(metadata['fileSize'])) if metadata.get('fileSize') is not None else 'size unknown'
+        stored = 'stored' if drive_file_stored(file_id, metadata, asset_store) else 'to download'
+        return f"[{url}] drive [{metadata['title']}] {metadata['mimeType']}, {size}, {stored}"
+
+    if url.startswith('http'):
+        stored_size = web_file_stored_size(url, asset_store)
+        if stored_size is None:
+            return f"[{url}] to download"
+
+        return f"[{url}] stored, {format_size(stored_size)}"
+
+    return f"[{url}] not a web or drive url"
+
+
+
+'''
+    whether the asset store has the version of a drive file that drive reports
+'''
+def drive_file_stored(file_id, metadata, asset_store):
+    entry = asset_store.lookup(f"drive:{file_id}")
+
+    return entry is not None and entry.get('version') == f"{metadata.get('modifiedDate')}|{metadata.get('version')}"
+
+
+
+'''
+    size of the stored copy of a web file, None if the asset store does not have it
+'''
+def web_file_stored_size(url, asset_store):
+    entry = asset_store.lookup(url)
+    if entry is None:
+        return None
+
+    return asset_store.object_path(entry).stat().st_size
+
+
+
+def format_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+
+        size = size / 1024
+
+
+
+# indentation of a level of the plan tree
+PLAN_INDENT = '    '
@@ -7,7 +7,6 @@ import re
 import importlib
 
 # import pandas as pd
-import pygsheets
 
 import urllib.request
 
@@ -15,7 +14,7 @@ from helper.logger import *
 from helper.gsheet.gsheet_util import *
 
 
-def process_gsheet(context, gsheet, parent, current_document_index, nesting_level):
+def process_gsheet(context, gsheet, parent, current_document_index, nesting_level, section_writer=None):
     data = {'sections': []}
 
     # worksheet-cache is nested dictionary of gsheet->worksheet as two different sheets may have worksheets of same name
@@ -23,18 +22,33 @@ def process_gsheet(context, gsheet, parent, current_document_index, nesting_leve
     if 'worksheet-cache' not in context:
         context['worksheet-cache'] = {}
 
+    # header/footer worksheets are written once in the top level worksheets table, sections refer to them by key
+    if 'worksheets' not in context:
+        context['worksheets'] = {}
+
     if gsheet.title not in context['worksheet-cache']:
         context['worksheet-cache'][gsheet.title] = {}
 
+    # the toc rows come from the grid data that was read with the gsheet, not from another api call
     ws_title = context['index-worksheet']
-    ws = gsheet.worksheet('title', ws_title)
+    if ws_title not in context['gsheet-data'][gsheet.title]:
+        warn(f"index worksheet [{ws_title}] not found in gsheet [{gsheet.title}]", nesting_level=nesting_level)
 
-    toc_list = ws.get_values(start='A3', end=f"Y{ws.rows}", returnas='matrix', majdim='ROWS', include_tailing_empty=True, include_tailing_empty_rows=False, value_render='FORMULA')
-    toc_list = [toc for toc in toc_list if toc[2] == 'Yes' and toc[3] in [0, 1, 2, 3, 4, 5, 6]]
+    toc_list = get_toc_list(context['gsheet-data'][gsheet.title].get(ws_title))
 
     section_index = 0
     for toc in toc_list:
-        data['sections'].append(process_section(context=context, gsheet=gsheet, toc=toc, current_document_index=current_document_index, section_index=section_index, parent=parent, nesting_level=nesting_level))
+        section_data = process_section(context=context, gsheet=gsheet, toc=toc, current_document_index=current_document_index, section_index=section_index, parent=parent, nesting_level=nesting_level)
+
+        # the backends reuse what they rendered earlier for a section with the same fingerprint
+        section_data['section-meta']['fingerprint'] = section_fingerprint(section_data, context['worksheets'])
+
+        # a streamed section is written out right away and not kept
+        if section_writer is not None:
+            section_writer.write_section(section_data)
+        else:
+            data['sections'].append(section_data)
+
         section_index = section_index + 1
 
     return data
@@ -105,6 +119,7 @@ def process_section(context, gsheet, toc, current_document_index, section_index,
             'responsible'           : toc[22].strip(),
             'reviewer'              : toc[23].strip(),
             'status'                : toc[24].strip(),
+            'raster-spec'           : str(toc[25]).strip(),
         },
         'header-odd'            : get_worksheet_link(toc[14]),
         'header-even'           : get_worksheet_link(toc[15]),
@@ -133,7 +148,6 @@ def process_section(context, gsheet, toc, current_document_index, section_index,
     different_odd_even_pages = False
 
     # the gsheet is a child gsheet, called from a parent gsheet, so header processing depends on override flags
-    module = importlib.import_module('processor.table_processor')
     if parent:
         parent_section_meta = parent['section-meta']
         parent_section_prop = parent['section-prop']
@@ -149,8 +163,7 @@ def process_section(context, gsheet, toc, current_document_index, section_index,
             # debug(f".. child gsheet's header is NOT overridden")
             if section_prop['different-firstpage']:
                 if d['header-first'] != '' and d['header-first'] is not None:
-                    new_section_data = {'section-prop': {'link': d['header-first']}}
-                    d['header-first'] = module.process(gsheet=gsheet, section_data=new_section_data, context=context, current_document_index=current_document_index, nesting_level=nesting_level)
+                    d['header-first'] = process_header_footer(context=context, gsheet=gsheet, ws_title=d['header-first'], current_document_index=current_document_index, nesting_level=nesting_level)
 
                 else:
                     d['header-first'] = None
@@ -160,16 +173,14 @@ def process_section(context, gsheet, toc, current_document_index, section_index,
 
 
             if d['header-odd'] != '' and d['header-odd'] is not None:
-                new_section_data = {'section-prop': {'link': d['header-odd']}}
-                d['header-odd'] = module.process(gsheet=gsheet, section_data=new_section_data, context=context, current_document_index=current_document_index, nesting_level=nesting_level)
+                d['header-odd'] = process_header_footer(context=context, gsheet=gsheet, ws_title=d['header-odd'], current_document_index=current_document_index, nesting_level=nesting_level)
 
             else:
                 d['header-odd'] = None
 
 
             if d['header-even'] != '' and d['header-even'] is not None:
-                new_section_data = {'section-prop': {'link': d['header-even']}}
-                d['header-even'] = module.process(gsheet=gsheet, section_data=new_section_data, context=context, current_document_index=current_document_index, nesting_level=nesting_level)
+                d['header-even'] = process_header_footer(context=context, gsheet=gsheet, ws_title=d['header-even'], current_document_index=current_document_index, nesting_level=nesting_level)
                 different_odd_even_pages = True
 
             else:
@@ -187,8 +198,7 @@ def process_section(context, gsheet, toc, current_document_index, section_index,
             # debug(f".. child gsheet's footer is NOT overridden")
             if section_prop['different-firstpage']:
                 if d['footer-first'] != '' and d['footer-first'] is not None:
-                    new_section_data = {'section-prop': {'link': d['footer-first']}}
-                    d['footer-first'] = module.process(gsheet=gsheet, section_data=new_section_data, context=context, current_document_index=current_document_index, nesting_level=nesting_level)
+                    d['footer-first'] = process_header_footer(context=context, gsheet=gsheet, ws_title=d['footer-first'], current_document_index=current_document_index, nesting_level=nesting_level)
 
                 else:
                     d['footer-first'] = None
@@ -198,16 +208,14 @@ def process_section(context, gsheet, toc, current_document_index, section_index,
 
 
             if d['footer-odd'] != '' and d['footer-odd'] is not None:
-                new_section_data = {'section-prop': {'link': d['footer-odd']}}
-                d['footer-odd'] = module.process(gsheet=gsheet, section_data=new_section_data, context=context, current_document_index=current_document_index, nesting_level=nesting_level)
+                d['footer-odd'] = process_header_footer(context=context, gsheet=gsheet, ws_title=d['footer-odd'], current_document_index=current_document_index, nesting_level=nesting_level)
             
             else:
                 d['footer-odd'] = None
 
 
             if d['footer-even'] != '' and d['footer-even'] is not None:
-                new_section_data = {'section-prop': {'link': d['footer-even']}}
-                d['footer-even'] = module.process(gsheet=gsheet, section_data=new_section_data, context=context, current_document_index=current_document_index, nesting_level=nesting_level)
+                d['footer-even'] = process_header_footer(context=context, gsheet=gsheet, ws_title=d['footer-even'], current_document_index=current_document_index, nesting_level=nesting_level)
                 different_odd_even_pages = True
 
             else:
@@ -217,16 +225,14 @@ def process_section(context, gsheet, toc, current_document_index, section_index,
         # process header, it may be text or link
         if section_prop['different-firstpage']:
             if d['header-first'] != '' and d['header-first'] is not None:
-                new_section_data = {'section-prop': {'link': d['header-first']}}
-                d['header-first'] = module.process(gsheet=gsheet, section_data=new_section_data, context=context, current_document_index=current_document_index, nesting_level=nesting_level)
+                d['header-first'] = process_header_footer(context=context, gsheet=gsheet, ws_title=d['header-first'], current_document_index=current_document_index, nesting_level=nesting_level)
 
             else:
                 d['header-first'] = None
 
 
             if d['footer-first'] != '' and d['footer-first'] is not None:
-                new_section_data = {'section-prop': {'link': d['footer-first']}}
-                d['footer-first'] = module.process(gsheet=gsheet, section_data=new_section_data, context=context, current_document_index=current_document_index, nesting_level=nesting_level)
+                d['footer-first'] = process_header_footer(context=context, gsheet=gsheet, ws_title=d['footer-first'], current_document_index=current_document_index, nesting_level=nesting_level)
 
             else:
                 d['footer-first'] = None
@@ -237,16 +243,14 @@ def process_section(context, gsheet, toc, current_document_index, section_index,
 
 
         if d['header-odd'] != '' and d['header-odd'] is not None:
-            new_section_data = {'section-prop': {'link': d['header-odd']}}
-            d['header-odd'] = module.process(gsheet=gsheet, section_data=new_section_data, context=context, current_document_index=current_document_index, nesting_level=nesting_level)
+            d['header-odd'] = process_header_footer(context=context, gsheet=gsheet, ws_title=d['header-odd'], current_document_index=current_document_index, nesting_level=nesting_level)
 
         else:
             d['header-odd'] = None
 
 
         if d['header-even'] != '' and d['header-even'] is not None:
-            new_section_data = {'section-prop': {'link': d['header-even']}}
-            d['header-even'] = module.process(gsheet=gsheet, section_data=new_section_data, context=context, current_document_index=current_document_index, nesting_level=nesting_level)
+            d['header-even'] = process_header_footer(context=context, gsheet=gsheet, ws_title=d['header-even'], current_document_index=current_document_index, nesting_level=nesting_level)
             different_odd_even_pages = True
 
         else:
@@ -254,16 +258,14 @@ def process_section(context, gsheet, toc, current_document_index, section_index,
 
 
         if d['footer-odd'] != '' and d['footer-odd'] is not None:
-            new_section_data = {'section-prop': {'link': d['footer-odd']}}
-            d['footer-odd'] = module.process(gsheet=gsheet, section_data=new_section_data, context=context, current_document_index=current_document_index, nesting_level=nesting_level)
+            d['footer-odd'] = process_header_footer(context=context, gsheet=gsheet, ws_title=d['footer-odd'], current_document_index=current_document_index, nesting_level=nesting_level)
 
         else:
             d['footer-odd'] = None
 
 
         if d['footer-even'] != '' and d['footer-even'] is not None:
-            new_section_data = {'section-prop': {'link': d['footer-even']}}
-            d['footer-even'] = module.process(gsheet=gsheet, section_data=new_section_data, context=context, current_document_index=current_document_index, nesting_level=nesting_level)
+            d['footer-even'] = process_header_footer(context=context, gsheet=gsheet, ws_title=d['footer-even'], current_document_index=current_document_index, nesting_level=nesting_level)
             different_odd_even_pages = True
 
         else:
@@ -274,7 +276,7 @@ def process_section(context, gsheet, toc, current_document_index, section_index,
 
     # process 'background-image'
     if section_prop['background-image'] != '':
-        bg_dict = download_image(url=section_prop['background-image'], tmp_dir=context['tmp-dir'], nesting_level=nesting_level)
+        bg_dict = download_image(url=section_prop['background-image'], asset_store=context['asset-store'], nesting_level=nesting_level)
         if bg_dict:
             section_prop['background-image'] = bg_dict['file-path']
         else:
@@ -289,3 +291,20 @@ def process_section(context, gsheet, toc, current_document_index, section_index,
         d['contents'] = module.process(gsheet=gsheet, section_data=d, context=context, current_document_index=current_document_index, nesting_level=nesting_level)
 
     return d
+
+
+
+def process_header_footer(context, gsheet, ws_title, current_document_index, nesting_level):
+    module = importlib.import_module('processor.table_processor')
+    new_section_data = {'section-prop': {'link': ws_title}}
+    worksheet_data = module.process(gsheet=gsheet, section_data=new_section_data, context=context, current_document_index=current_document_index, nesting_level=nesting_level)
+
+    # a worksheet that is not found stays inline (empty)
+    if not worksheet_data:
+        return worksheet_data
+
+    # gsheet ids have no '/', the key is unique even if the worksheet title has one
+    key = f"{gsheet.id}/{ws_title}"
+    context['worksheets'][key] = worksheet_data
+
+    return {'worksheet-ref': key}
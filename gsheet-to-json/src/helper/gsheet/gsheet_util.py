@@ -1,15 +1,16 @@
 #!/usr/bin/env python3
 
-import re
+import json
+import hashlib
 from pathlib import Path
 
 import requests
 import urllib3
 
-import pygsheets
-from PIL import Image
-
 from helper.logger import *
+from helper.gsheet.formula_util import *
+from helper.asset.image_util import probe_image
+from helper.gdrive.gdrive_util import get_drive_file_metadata, download_drive_content
 
 
 '''
@@ -25,10 +26,10 @@ def gsheet_id_from_url(url, nesting_level):
 def get_gsheet_link(value, nesting_level=0):
     link_name, link_target = value, None
 
-    m = re.match('=HYPERLINK\("(?P<link_url>.+)",\s*"(?P<link_title>.+)"\)', value, re.IGNORECASE)
-    if m and m.group('link_url') is not None and m.group('link_title') is not None:
-        # debug(f".. found a link to [{url}] at [{m.group('link_url')}]", nesting_level=nesting_level)
-        link_name, link_target = m.group('link_title'), m.group('link_url')
+    formula = classify_formula(value)
+    if formula.url is not None:
+        # debug(f".. found a link to [{url}] at [{formula.url}]", nesting_level=nesting_level)
+        link_name, link_target = formula.title, formula.url
 
     else:
         link_target = value
@@ -42,26 +43,158 @@ def get_worksheet_link(value, nesting_level=0):
     link_name = value
 
     # content can be a HYPERLINK/hyperlink to another worksheet
-    m = re.match('=HYPERLINK\("#gid=(?P<ws_gid>.+)",\s*"(?P<ws_title>.+)"\)', value, re.IGNORECASE)
-    if m and m.group('ws_gid') is not None and m.group('ws_title') is not None:
-        # debug(m.group('ws_gid'), m.group('ws_title'), nesting_level=nesting_level)
-        link_name = m.group('ws_title')
+    formula = classify_formula(value)
+    if formula.kind == FORMULA_WORKSHEET_LINK:
+        # debug(formula.gid, formula.title, nesting_level=nesting_level)
+        link_name = formula.title
 
     return link_name
 
 
 
-def worksheet_exists(sheet, ws_title, nesting_level=0):
-    try:
-        ws = sheet.worksheet('title', ws_title)
-        return True
-    except:
-        warn(f"no worksheet ... [{ws_title}]", nesting_level=nesting_level)
-        return False
+'''
+    value of a cell from grid data as returned by a FORMULA value render - the formula if there is one, else the entered value
+'''
+def get_cell_value(cell_data):
+    user_entered_value = cell_data.get('userEnteredValue')
+    if user_entered_value is None:
+        return ''
+
+    for key in ['formulaValue', 'stringValue', 'numberValue', 'boolValue']:
+        if key in user_entered_value:
+            return user_entered_value[key]
+
+    return ''
+
+
+
+'''
+    toc rows (A3:Z) of the index worksheet built from the worksheet's grid data, only the rows that are to be processed
+'''
+def get_toc_list(worksheet_data, column_count=26):
+    toc_list = []
+    if not worksheet_data or 'data' not in worksheet_data or len(worksheet_data['data']) == 0:
+        return toc_list
+
+    for row_data in worksheet_data['data'][0].get('rowData', [])[2:]:
+        values = row_data.get('values', [])[0:column_count]
+        toc = [get_cell_value(cell_data) for cell_data in values]
+        toc = toc + [''] * (column_count - len(toc))
+        toc_list.append(toc)
+
+    toc_list = [toc for toc in toc_list if toc[2] == 'Yes' and toc[3] in [0, 1, 2, 3, 4, 5, 6]]
+
+    return toc_list
+
+
+
+'''
+    worksheets referenced from the toc rows - table sections and headers/footers
+'''
+def get_referenced_worksheets(toc_list):
+    ws_titles = []
+    for toc in toc_list:
+        values = [toc[13], toc[14], toc[15], toc[16], toc[17], toc[18]]
+        if toc[4] == 'table':
+            values.append(toc[5])
+
+        for value in values:
+            if not isinstance(value, str) or value == '':
+                continue
+
+            ws_title = get_worksheet_link(value)
+            if ws_title not in ws_titles:
+                ws_titles.append(ws_title)
+
+    return ws_titles
+
+
+
+'''
+    worksheets linked through =HYPERLINK("#gid=...", "...") formulas from the cells of a worksheet
+'''
+def get_linked_worksheets(worksheet_data):
+    ws_titles = []
+    if not worksheet_data or 'data' not in worksheet_data or len(worksheet_data['data']) == 0:
+        return ws_titles
+
+    for row_data in worksheet_data['data'][0].get('rowData', []):
+        for cell_data in row_data.get('values', []):
+            formula_value = cell_data.get('userEnteredValue', {}).get('formulaValue')
+            if formula_value is None:
+                continue
+
+            formula = classify_formula(formula_value)
+            if formula.kind == FORMULA_WORKSHEET_LINK:
+                if formula.title not in ws_titles:
+                    ws_titles.append(formula.title)
+
+    return ws_titles
+
+
+
+'''
+    urls of =HYPERLINK("...", "...") formulas (other than #gid= links) from the cells of a worksheet
+'''
+def get_hyperlinks(worksheet_data):
+    urls = []
+    if not worksheet_data or 'data' not in worksheet_data or len(worksheet_data['data']) == 0:
+        return urls
+
+    for row_data in worksheet_data['data'][0].get('rowData', []):
+        for cell_data in row_data.get('values', []):
+            formula_value = cell_data.get('userEnteredValue', {}).get('formulaValue')
+            if formula_value is None:
+                continue
+
+            formula = classify_formula(formula_value)
+            if formula.url is not None and formula.kind != FORMULA_WORKSHEET_LINK:
+                if formula.url not in urls:
+                    urls.append(formula.url)
+
+    return urls
+
+
+
+'''
+    A1 range covering a whole worksheet
+'''
+def worksheet_range(ws_title):
+    return "'{}'".format(ws_title.replace("'", "''"))
+
+
+
+'''
+    fingerprint of a section - sha256 of its data, which covers the worksheet grid data, the linked assets (their paths are content addressed)
+    and nested sections; header/footer references are resolved from worksheets so that a change in a shared header changes the fingerprint
+'''
+def section_fingerprint(section_data, worksheets={}):
+    resolved = dict(section_data)
+    for slot in HEADER_FOOTER_SLOTS:
+        if is_worksheet_ref(resolved.get(slot)):
+            resolved[slot] = worksheets[resolved[slot]['worksheet-ref']]
+
+    return hashlib.sha256(json.dumps(resolved, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+
+'''
+    fingerprint of a copy of a section that differs from the original only in its document index
+'''
+def derived_fingerprint(fingerprint, document_index):
+    return hashlib.sha256(f"{fingerprint}|{document_index}".encode('utf-8')).hexdigest()
+
+
+
+'''
+    whether a value is a reference ({'worksheet-ref': key}) into the top level worksheets table
+'''
+def is_worksheet_ref(value):
+    return isinstance(value, dict) and len(value) == 1 and 'worksheet-ref' in value
 
 
 
-def download_image_from_formula(image_formula, tmp_dir, row_height, nesting_level=0):
+def download_image_from_formula(image_formula, asset_store, row_height, nesting_level=0):
     '''
         image_formula liiks like
         "http://documents.biasl.net/data/projects/rhd/filling-station-367x221.png", 3'\
@@ -75,56 +208,27 @@ def download_image_from_formula(image_formula, tmp_dir, row_height, nesting_leve
     if len(s) >= 1:
         url = s[0]
 
-        # localpath is the last term if it ends with png/jpg/gif/webp, if not
-        url_splitted = url.split('/')
-        if url_splitted[-1].endswith('.png') or url_splitted[-1].endswith('.jpg') or url_splitted[-1].endswith('.gif') or url_splitted[-1].endswith('.webp'):
-            local_path = f"{tmp_dir}/{url_splitted[-1]}"
-
-        # if it is owncloud, (https://storage.brilliant.com.bd/s/IPO46mdbcetahMf/download) we use the penaltimate term and append a .png
-        elif len(url_splitted) >= 6 and 'storage.brilliant.com.bd' in url_splitted[2]:
-            local_path = f"{tmp_dir}/{url_splitted[-2]}.png"
-
-        else:
-            warn(f"url pattern unknown for file: {url}", nesting_level=nesting_level)
+        ext = image_extension(url, nesting_level=nesting_level)
+        if ext is None:
             return None
 
-        local_path = Path(local_path).resolve()
-
-        # download image in url into localpath
+        # download image in url into the asset store (it may already be there, downloaded ahead of processing or by an earlier run)
         try:
-            # if the image is already in the local_path, we do not download it
-            if Path(local_path).exists():
-                debug(f"image existing   at: [{local_path}]", nesting_level=nesting_level)
-            else:
-                response = requests.get(url, stream=True)
-                if not response.ok:
-                    warn(f"{response} could not download image: [{url}]", nesting_level=nesting_level)
-                    return None
-
-                with open(local_path, 'wb') as handle:
-                    for block in response.iter_content(512):
-                        if not block:
-                            break
-
-                        handle.write(block)
-
-                debug(f"image downloaded at: [{local_path}]", nesting_level=nesting_level)
+            local_path = asset_store.fetch(url, ext, nesting_level=nesting_level)
+            if local_path is None:
+                return None
 
         except Exception as err:
             warn(f"could not download : [{url}]", nesting_level=nesting_level)
             print(Exception, err)
             return None
 
-    # get the image dimensions
+    # get the image dimensions, from the image header - the image is not decoded
     try:
-        im = Image.open(local_path)
-        im_width, im_height = im.size
-        if 'dpi' in im.info:
-            # dpi values are of type IFDRational which is not JSON serializable, cast them to float
-            im_dpi_x, im_dpi_y = im.info['dpi']
-            im_dpi_x = float(im_dpi_x)
-            im_dpi_y = float(im_dpi_y)
-            im_dpi = (im_dpi_x, im_dpi_y)
+        probe = probe_image(local_path)
+        im_width, im_height = probe['size']
+        if probe['dpi'] is not None:
+            im_dpi = probe['dpi']
         else:
             im_dpi = (96, 96)
 
@@ -145,24 +249,86 @@ def download_image_from_formula(image_formula, tmp_dir, row_height, nesting_leve
         height = row_height
         width = int(height * aspect_ratio)
         # info(f"adjusting image {local_path} at {width}x{height}-{im_dpi} based on row height {row_height}", nesting_level=nesting_level)
-        return {'url': url, 'path': str(local_path), 'height': height, 'width': width, 'dpi': im_dpi, 'size': im.size, 'mode': mode}
+        return {'url': url, 'path': str(local_path), 'height': height, 'width': width, 'dpi': im_dpi, 'size': probe['size'], 'mode': mode}
 
     # image link is without height, width - use actual image size
     if mode == 3:
         # info(f"keeping image {local_path} at {im_width}x{im_height}-{im_dpi} as-is", nesting_level=nesting_level)
-        return {'url': url, 'path': str(local_path), 'height': im_height, 'width': im_width, 'dpi': im_dpi, 'size': im.size, 'mode': mode}
+        return {'url': url, 'path': str(local_path), 'height': im_height, 'width': im_width, 'dpi': im_dpi, 'size': probe['size'], 'mode': mode}
 
     # image link specifies height and width, use those
     if mode == 4 and len(s) == 4:
         # info(f"image {local_path} at {im_width}x{im_height}-{im_dpi} size specified", nesting_level=nesting_level)
-        return {'url': url, 'path': str(local_path), 'height': int(s[2]), 'width': int(s[3]), 'dpi': im_dpi, 'size': im.size, 'mode': mode}
+        return {'url': url, 'path': str(local_path), 'height': int(s[2]), 'width': int(s[3]), 'dpi': im_dpi, 'size': probe['size'], 'mode': mode}
     else:
         warn(f"image link does not specify height and width: [{image_formula}]", nesting_level=nesting_level)
         return None
 
 
 
-def download_file_from_web(url, tmp_dir, nesting_level=0):
+'''
+    url of the image in an image formula (the part inside =IMAGE(...))
+'''
+def image_url_from_formula(image_formula):
+    return image_formula.replace('"', '').split(',')[0]
+
+
+
+'''
+    extension of the file an image url is stored as, None if the url pattern is not known
+'''
+def image_extension(url, nesting_level=0):
+    # the extension of the last term if it ends with png/jpg/gif/webp, if not
+    url_splitted = url.split('/')
+    for ext in ['.png', '.jpg', '.gif', '.webp']:
+        if url_splitted[-1].endswith(ext):
+            return ext
+
+    # if it is owncloud, (https://storage.brilliant.com.bd/s/IPO46mdbcetahMf/download) it is a .png
+    if len(url_splitted) >= 6 and 'storage.brilliant.com.bd' in url_splitted[2]:
+        return '.png'
+
+    warn(f"url pattern unknown for file: {url}", nesting_level=nesting_level)
+    return None
+
+
+
+'''
+    the image formulas (the part inside =IMAGE(...)) in the cells of a worksheet
+'''
+def get_image_formulas(worksheet_data):
+    image_formulas = []
+    if not worksheet_data or 'data' not in worksheet_data or len(worksheet_data['data']) == 0:
+        return image_formulas
+
+    for row_data in worksheet_data['data'][0].get('rowData', []):
+        for cell_data in row_data.get('values', []):
+            formula_value = cell_data.get('userEnteredValue', {}).get('formulaValue')
+            if formula_value is None:
+                continue
+
+            formula = classify_formula(formula_value)
+            if formula.kind == FORMULA_IMAGE:
+                image_formulas.append(formula.image)
+
+    return image_formulas
+
+
+
+'''
+    a requests session with a connection pool large enough to be shared by the download workers
+'''
+def new_http_session(pool_size=10):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+
+def download_file_from_web(url, asset_store, nesting_level=0):
     file_url = url.strip()
     file_ext = file_url[-4:]
     if not file_ext in ['.pdf', '.png', '.jpg', '.gif', '.webp']:
@@ -185,20 +351,11 @@ def download_file_from_web(url, tmp_dir, nesting_level=0):
     elif file_ext == '.webp':
         file_type = 'image/webp'
 
-    # download pdf in url into localpath
+    # download pdf in url into the asset store, unless the stored copy is still valid
     try:
-        local_path = f"{tmp_dir}/{file_name}"
-        local_path = Path(local_path).resolve()
-        # if the pdf is already in the local_path, we do not download it
-        if Path(local_path).exists():
-            debug(f"file existing   [{file_url}]", nesting_level=nesting_level)
-            # pass
-        else:
-            file_data = requests.get(file_url).content
-            with open(local_path, 'wb') as handler:
-                handler.write(file_data)
-
-            debug(f"file downloaded [{file_url}]", nesting_level=nesting_level)
+        local_path = asset_store.fetch(file_url, file_ext, nesting_level=nesting_level)
+        if local_path is None:
+            return None
 
         return {'file-name': file_name, 'file-type': file_type, 'file-path': str(local_path)}
     except:
@@ -207,17 +364,22 @@ def download_file_from_web(url, tmp_dir, nesting_level=0):
 
 
 
-def download_file_from_drive(url, tmp_dir, drive, nesting_level=0):
+def download_file_from_drive(url, asset_store, drive_service, drive_metadata={}, http=None, nesting_level=0):
     file_url = url.strip()
 
     id = file_url.replace('https://drive.google.com/file/d/', '')
     id = id.split('/')[0]
     debug(f"downloading drive file id = [{id}]", nesting_level=nesting_level)
-    f = drive.CreateFile({'id': id})
-    file_name = f['title']
-    file_type = f['mimeType']
+
+    # with metadata from a batch lookup, title/mimeType do not cost a call of their own
+    if id in drive_metadata:
+        metadata = drive_metadata[id]
+    else:
+        metadata = get_drive_file_metadata(drive_service, id, http=http)
+    file_name = metadata['title']
+    file_type = metadata['mimeType']
     if not file_type in ['application/pdf', 'image/png', 'image/jpeg', 'image/gif', 'image/webp']:
-        warn(f"drive url {url} is not a pdf/png/jpg/gif/webp, it is [{f['mimeType']}]", nesting_level=nesting_level)
+        warn(f"drive url {url} is not a pdf/png/jpg/gif/webp, it is [{metadata['mimeType']}]", nesting_level=nesting_level)
         return None
 
     if file_type == 'application/pdf' and not file_name.endswith('.pdf'):
@@ -236,14 +398,14 @@ def download_file_from_drive(url, tmp_dir, drive, nesting_level=0):
         file_name = file_name + '.webp'
 
     try:
-        local_path = f"{tmp_dir}/{file_name}"
-        local_path = Path(local_path).resolve()
-        # if the pdf is already in the local_path, we do not download it
-        if Path(local_path).exists():
+        # the stored copy is valid as long as drive reports the same modified time/version
+        key = f"drive:{id}"
+        version = f"{metadata.get('modifiedDate')}|{metadata.get('version')}"
+        local_path = asset_store.get(key, version)
+        if local_path is not None:
             debug(f"drive file existing   at: [{local_path}]", nesting_level=nesting_level)
-            # pass            
         else:
-            f.GetContentFile(local_path)
+            local_path = asset_store.put(key, version, Path(file_name).suffix, lambda file_path: download_drive_content(drive_service, id, file_path, http=http))
             debug(f"drive file downloaded at: [{local_path}]", nesting_level=nesting_level)
 
         return {'file-name': file_name, 'file-type': file_type, 'file-path': str(local_path)}
@@ -253,28 +415,39 @@ def download_file_from_drive(url, tmp_dir, drive, nesting_level=0):
 
 
 
-def read_web_content(web_url, nesting_level=0):
+'''
+    text content of a web url, through the asset store - the stored copy is revalidated (ETag/Last-Modified) once per run
+'''
+def read_web_content(web_url, asset_store, nesting_level=0):
     url = web_url.strip()
 
     # read content from url
     try:
-        http = urllib3.PoolManager()
-        response = http.request('GET', url)
-        text = response.data.decode('utf-8')
-        return text
+        local_path = asset_store.fetch(url, '.txt', nesting_level=nesting_level)
+        if local_path is None:
+            return None
+
+        with open(local_path, 'r', encoding='utf-8') as f:
+            return f.read()
+
     except:
         error(f"could not read content from url: [{web_url}]", nesting_level=nesting_level)
         return None
 
 
 
-def download_image(url, tmp_dir, nesting_level=0):
+def download_image(url, asset_store, nesting_level=0):
     data = None
     if url.startswith('http'):
         # the file url is a normal web url
-        data = download_file_from_web(url=url, tmp_dir=tmp_dir)
+        data = download_file_from_web(url=url, asset_store=asset_store)
 
     else:
         warn(f"the url [{url}] is not a web url", nesting_level=nesting_level)
 
     return data
+
+
+
+# the section keys that hold header/footer worksheets
+HEADER_FOOTER_SLOTS = ['header-first', 'header-odd', 'header-even', 'footer-first', 'footer-odd', 'footer-even']
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from shared.json_util import json_format, open_json_writer, required, msgpack
+from helper.logger import *
+
+
+class JsonWriter(object):
+
+    """ writes the output json ({"sections": [...], "worksheets": {...}}) one section at a time as sections are completed, so that
+        only one section needs to be in memory; compact by default, indented by 4 (as json.dumps(indent=4) would) if pretty
+        the file is written under a temporary name and renamed when complete, a failed run leaves the previous output in place
+        the extension picks the format - .json, .json.gz, .json.zst or .msgpack (pretty applies to the json formats only)
+    """
+
+    def __init__(self, path, pretty=False):
+        self._path = Path(path)
+        self._tmp_path = self._path.with_name(
+            f"{self._path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        self._format = json_format(self._path)
+        self._pretty = pretty
+        if pretty:
+            self._encoder = json.JSONEncoder(indent=4)
+        else:
+            self._encoder = json.JSONEncoder(separators=(",", ":"))
+
+        self._file = None
+        self._section_count = 0
+        self._worksheets = None
+
+    def __enter__(self):
+        if self._format == ".msgpack":
+            # the array header needs the section count, sections are packed to the temporary file first and the file is
+            # assembled at the end
+            self._packer = required(msgpack, "msgpack", self._path).Packer()
+            self._file = open(self._tmp_path, "wb")
+            return self
+
+        # the temporary name has no telling extension, the format is that of the final name
+        self._file = open_json_writer(self._tmp_path, self._format)
+        self._file.write('{\n    "sections": [' if self._pretty else '{"sections":[')
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None and self._format == ".msgpack":
+                self._file.close()
+                self.assemble_msgpack()
+
+            elif exc_type is None:
+                if self._section_count == 0:
+                    self._file.write("]")
+                else:
+                    self._file.write("\n    ]" if self._pretty else "]")
+
+                if self._worksheets is not None:
+                    self._file.write(',\n    "worksheets": ' if self._pretty else ',"worksheets":')
+                    for chunk in self._encoder.iterencode(self._worksheets):
+                        self._file.write(chunk.replace("\n", "\n    ") if self._pretty else chunk)
+
+                self._file.write("\n}" if self._pretty else "}")
+
+            self._file.close()
+            if exc_type is None:
+                os.replace(self._tmp_path, self._path)
+
+        finally:
+            if self._tmp_path.exists():
+                self._tmp_path.unlink()
+
+    """ write a completed section
+    """
+
+    def write_section(self, section_data):
+        if self._format == ".msgpack":
+            self._file.write(self._packer.pack(section_data))
+
+        elif self._pretty:
+            self._file.write(",\n        " if self._section_count else "\n        ")
+            # newlines inside json strings are escaped, every newline in a chunk is indentation
+            for chunk in self._encoder.iterencode(section_data):
+                self._file.write(chunk.replace("\n", "\n        "))
+
+        else:
+            if self._section_count:
+                self._file.write(",")
+
+            for chunk in self._encoder.iterencode(section_data):
+                self._file.write(chunk)
+
+        self._section_count = self._section_count + 1
+
+    """ the worksheets table (header/footer worksheets referenced by key from sections), written after the sections
+    """
+
+    def write_worksheets(self, worksheets):
+        self._worksheets = worksheets
+
+    """ the msgpack file - a map of the sections (copied from the temporary file) and the worksheets table, in place of the temporary file
+    """
+
+    def assemble_msgpack(self):
+        sections_path = self._tmp_path.with_name(f"{self._tmp_path.name}.sections")
+        os.replace(self._tmp_path, sections_path)
+        try:
+            with open(self._tmp_path, "wb") as f:
+                f.write(self._packer.pack_map_header(1 if self._worksheets is None else 2))
+                f.write(self._packer.pack("sections"))
+                f.write(self._packer.pack_array_header(self._section_count))
+                with open(sections_path, "rb") as sections:
+                    shutil.copyfileobj(sections, f)
+
+                if self._worksheets is not None:
+                    f.write(self._packer.pack("worksheets"))
+                    f.write(self._packer.pack(self._worksheets))
+
+        finally:
+            sections_path.unlink()
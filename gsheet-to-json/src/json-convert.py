@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+'''
+convert a gsheet-to-json output between formats - .json, .json.gz, .json.zst and .msgpack, picked by extension
+'''
+import sys
+import time
+import argparse
+from pathlib import Path
+
+# the modules shared by gsheet-to-json and the json-to-* backends are in shared/ at the root of the repository
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
+from helper.logger import *
+from shared.json_util import read_json_file
+from helper.json_writer import JsonWriter
+
+
+class JsonConvert(object):
+
+	def __init__(self, input_path, output_path, pretty=False):
+		self.start_time = int(round(time.time() * 1000))
+		self._input_path = input_path
+		self._output_path = output_path
+		self._pretty = pretty
+
+
+	def run(self):
+		info(f"reading   [{self._input_path}]")
+		data = read_json_file(self._input_path)
+
+		info(f"writing   [{self._output_path}]")
+		with JsonWriter(self._output_path, pretty=self._pretty) as json_writer:
+			for section_data in data['sections']:
+				json_writer.write_section(section_data)
+
+			if 'worksheets' in data:
+				json_writer.write_worksheets(data['worksheets'])
+
+		self.end_time = int(round(time.time() * 1000))
+		debug(f"script took {(self.end_time - self.start_time)/1000} seconds")
+
+
+if __name__ == '__main__':
+	# construct the argument parse and parse the arguments
+	ap = argparse.ArgumentParser()
+	ap.add_argument("-i", "--input", required=True, help="input path (.json, .json.gz, .json.zst or .msgpack)")
+	ap.add_argument("-o", "--output", required=True, help="output path (.json, .json.gz, .json.zst or .msgpack)")
+	ap.add_argument("--pretty", required=False, action="store_true", help="write indented json instead of compact json")
+	args = vars(ap.parse_args())
+
+	converter = JsonConvert(args["input"], args["output"], pretty=args["pretty"])
+	converter.run()
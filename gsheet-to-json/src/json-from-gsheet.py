@@ -11,27 +11,47 @@ import argparse
 import pprint
 from pathlib import Path
 
+# the modules shared by gsheet-to-json and the json-to-* backends are in shared/ at the root of the repository
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
 from helper.logger import *
+from helper.api_scheduler import ApiScheduler
 from helper.gsheet.gsheet_helper import GsheetHelper
+from helper.gsheet.gsheet_plan import estimate_lines
+from helper.json_writer import JsonWriter
 
 
 class JsonFromGsheet(object):
 
-	def __init__(self, config_path, gsheet=None):
+	def __init__(self, config_path, gsheet=None, no_cache=False, refresh=False, pretty=False, plan=False):
 		self.start_time = int(round(time.time() * 1000))
 		self._config_path = Path(config_path).resolve()
 		self._data = {}
 		self._gsheet = gsheet
+		self._no_cache = no_cache
+		self._refresh = refresh
+		self._pretty = pretty
+		self._plan = plan
 
 
 	def run(self):
 		self.set_up()
 
+		# a dry run - what a build would read and download and what it would cost, nothing is written
+		if self._plan:
+			for gsheet_title in self._CONFIG['gsheets']:
+				plan = self._gsheethelper.plan_gsheet(gsheet_title=gsheet_title, nesting_level=0)
+				print('\n'.join(plan['lines'] + [''] + estimate_lines(plan['estimate']) + ['']))
+
+			self.tear_down()
+			return
+
 		# process gsheets one by one
 		for gsheet_title in self._CONFIG['gsheets']:
-			self._CONFIG['files']['output-json'] = f"{self._CONFIG['dirs']['output-dir']}/{gsheet_title}.json"
-			self._data = self._gsheethelper.read_gsheet(gsheet_title=gsheet_title, nesting_level=0)
-			self.save_json()
+			self._CONFIG['files']['output-json'] = f"{self._CONFIG['dirs']['output-dir']}/{gsheet_title}.{self._CONFIG.get('output-format', 'json')}"
+			# sections are written to the output as they are completed
+			with JsonWriter(self._CONFIG['files']['output-json'], pretty=self._pretty) as json_writer:
+				self._data = self._gsheethelper.read_gsheet(gsheet_title=gsheet_title, section_writer=json_writer, nesting_level=0)
 
 		self.tear_down()
 
@@ -49,22 +69,35 @@ class JsonFromGsheet(object):
 		self._CONFIG['dirs']['temp-dir'] = self._CONFIG['dirs']['output-dir'] / 'tmp'
 		self._CONFIG['dirs']['temp-dir'].mkdir(parents=True, exist_ok=True)
 
+		# the asset store may be shared by runs with different output dirs
+		if 'asset-dir' in self._CONFIG['dirs']:
+			self._CONFIG['dirs']['asset-dir'] = config_dir / self._CONFIG['dirs']['asset-dir']
+		else:
+			self._CONFIG['dirs']['asset-dir'] = self._CONFIG['dirs']['temp-dir'] / 'assets'
+
 		self._CONFIG['files']['google-cred'] = config_dir / self._CONFIG['files']['google-cred']
 
+		# gsheet cache switches from the command line override the configuration
+		if 'gsheet-cache' not in self._CONFIG:
+			self._CONFIG['gsheet-cache'] = {}
+
+		if self._no_cache:
+			self._CONFIG['gsheet-cache']['enabled'] = False
+
+		if self._refresh:
+			self._CONFIG['gsheet-cache']['refresh'] = True
+
 		# gsheet-helper
 		self._gsheethelper = GsheetHelper()
 		self._gsheethelper.init(self._CONFIG)
 
 
-	def save_json(self):
-		with open(self._CONFIG['files']['output-json'], "w") as f:
-			f.write(json.dumps(self._data, sort_keys=False, indent=4))
-
-
 	def tear_down(self):
 		self.end_time = int(round(time.time() * 1000))
 		debug(f"{self._gsheethelper.current_document_index+1} documents/gsheets processed")
 		debug(f"script took {(self.end_time - self.start_time)/1000} seconds")
+		for api, counters in ApiScheduler().stats().items():
+			debug(f"{api} api : {counters['calls']} calls, {counters['retries']} retries, {counters['throttled']} throttled, {counters['failed']} failed, {counters['wait-seconds']:.1f}s rate limited, {counters['backoff-seconds']:.1f}s in backoff")
 		# input("Press Enter to continue...")
 
 
@@ -73,7 +106,11 @@ if __name__ == '__main__':
 	ap = argparse.ArgumentParser()
 	ap.add_argument("-c", "--config", required=True, help="configuration yml path")
 	ap.add_argument("-g", "--gsheet", required=False, help="gsheet name to override gsheet list provided in configuration")
+	ap.add_argument("--no-cache", required=False, action="store_true", help="neither use nor update the on-disk gsheet cache")
+	ap.add_argument("--refresh", required=False, action="store_true", help="read every gsheet afresh and update the on-disk gsheet cache")
+	ap.add_argument("--pretty", required=False, action="store_true", help="write json indented by 4 instead of compact json (the layout of the streamed output, not that of older outputs)")
+	ap.add_argument("--plan", required=False, action="store_true", help="print the gsheets, worksheets and files a build would read and an estimate of its api calls and bytes, without building")
 	args = vars(ap.parse_args())
 
-	generator = JsonFromGsheet(args["config"], args["gsheet"])
+	generator = JsonFromGsheet(args["config"], args["gsheet"], no_cache=args["no_cache"], refresh=args["refresh"], pretty=args["pretty"], plan=args["plan"])
 	generator.run()
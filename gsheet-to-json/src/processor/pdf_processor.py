@@ -1,11 +1,9 @@
 #!/usr/bin/env python3
 '''
 '''
-import pdf2image
-import pdf2image.exceptions
-from PIL import Image
-
 from helper.logger import *
+from helper.asset.image_util import probe_image
+from helper.asset.pdf_util import *
 from helper.gsheet.gsheet_helper import GsheetHelper
 from helper.gsheet.gsheet_util import *
 
@@ -16,12 +14,12 @@ def process(gsheet, section_data, context, current_document_index, nesting_level
     if pdf_url.startswith('https://drive.google.com/file/d/'):
         # the file is from gdrive
         info(f"processing drive file ... [{pdf_title}] : [{pdf_url}]", nesting_level=nesting_level)
-        data = download_file_from_drive(pdf_url, context['tmp-dir'], context['drive'], nesting_level=nesting_level+1)
+        data = download_file_from_drive(pdf_url, context['asset-store'], context['drive-service'], drive_metadata=context.get('drive-metadata', {}), nesting_level=nesting_level+1)
 
     elif pdf_url.startswith('http'):
         # the file url is a normal web url
         info(f"processing web file ... [{pdf_title}] : [{pdf_url}]", nesting_level=nesting_level)
-        data = download_file_from_web(pdf_url, context['tmp-dir'], nesting_level=nesting_level+1)
+        data = download_file_from_web(pdf_url, context['asset-store'], nesting_level=nesting_level+1)
 
     else:
         warn(f"the url {pdf_url} is neither a web nor a gdrive url", nesting_level=nesting_level+1)
@@ -35,13 +33,15 @@ def process(gsheet, section_data, context, current_document_index, nesting_level
         if file_name.endswith('pdf'):
             file_name = file_name[:-4]
 
-        dpi = 72
-        size = None
+        images = []
+        images_dpi = None
 
-        # if it is a pdf
+        # if it is a pdf - the pages may already have been rendered ahead of processing or by an earlier run
         if file_type == 'application/pdf':
             try:
-                images = pdf2image.convert_from_path(file_path, fmt='png', dpi=dpi, size=size, transparent=True, output_file=file_name, paths_only=True, output_folder=context['tmp-dir'])
+                options = raster_options(context['pdf-raster'], section_data['section-prop'].get('raster-spec', ''), nesting_level=nesting_level+1)
+                page_list = rasterize_pdf(file_path, context['pdf-pages-dir'], options, thread_count=context['pdf-raster-thread-count'], nesting_level=nesting_level+1)
+                images, images_dpi = page_list['pages'], page_list['dpi']
             except Exception as e:
                 print(e)
                 error(f".... could not convert {file_path} to image(s)", nesting_level=nesting_level)
@@ -52,10 +52,17 @@ def process(gsheet, section_data, context, current_document_index, nesting_level
 
         data['images'] = []
         for image in images:
-            im = Image.open(image)
-            width, height = im.size
-            if 'dpi' in im.info:
-                dpi_x, dpi_y = im.info['dpi']
+            probe = probe_image(image)
+            if probe is None:
+                warn(f"could not get dimesnion for image: [{image}]", nesting_level=nesting_level)
+                continue
+
+            # pdf pages are as large as the pdf page at the dpi they were rendered at
+            width, height = probe['size']
+            if images_dpi is not None:
+                dpi_x, dpi_y = images_dpi, images_dpi
+            elif probe['dpi'] is not None:
+                dpi_x, dpi_y = probe['dpi']
             else:
                 dpi_x, dpi_y = 72, 72
 
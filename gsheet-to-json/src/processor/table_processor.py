@@ -6,13 +6,14 @@ from collections import defaultdict
 import sys
 import re
 import time
-import pygsheets
 
 import urllib.request
 
 from helper.logger import *
 from helper.gsheet.gsheet_util import *
+from helper.gsheet.formula_util import *
 from helper.gdrive.gdrive_util import *
+from helper.gsheet.gsheet_helper import GsheetHelper
 
 
 def process(gsheet, section_data, context, current_document_index, nesting_level):
@@ -23,6 +24,12 @@ def process(gsheet, section_data, context, current_document_index, nesting_level
     if ws_title in context['worksheet-cache'][gsheet.title]:
         return context['worksheet-cache'][gsheet.title][ws_title]
 
+    # a worksheet that links (directly or through other worksheets) back to itself would be processed forever
+    in_progress = context.setdefault('worksheet-in-progress', set())
+    if (gsheet.title, ws_title) in in_progress:
+        error(f"worksheet link cycle, [{gsheet.title}] : [{ws_title}] is not expanded again", nesting_level=nesting_level)
+        return {}
+
     info(f"processing ... [{gsheet.title}] : [{ws_title}]", nesting_level=nesting_level)
 
     # get the worksheet data from the context['gsheet-data']
@@ -32,8 +39,10 @@ def process(gsheet, section_data, context, current_document_index, nesting_level
         warn(f"worksheet [{ws_title}] not found", nesting_level=nesting_level)
         return {}
 
+    in_progress.add((gsheet.title, ws_title))
 
     # if any of the cells have userEnteredValue of IMAGE or HYPERLINK, process it
+    text_cells = []
     row = 2
     # start at row 3
     for row_data in worksheet_data['data'][0]['rowData'][2:]:
@@ -46,40 +55,34 @@ def process(gsheet, section_data, context, current_document_index, nesting_level
 
                     # process where cell contains formulas - image, link to another worksheet, link to another document in gdrive or url
                     if 'formulaValue' in userEnteredValue:
-                        formulaValue = userEnteredValue['formulaValue']
+                        formula = classify_formula(userEnteredValue['formulaValue'])
 
                         # content can be an IMAGE/image with an image formula like "=image(....)"
-                        m = re.match('=IMAGE\((?P<name>.+)\)', formulaValue, re.IGNORECASE)
-                        if m and m.group('name') is not None:
+                        if formula.kind == FORMULA_IMAGE:
                             row_height = worksheet_data['data'][0]['rowMetadata'][row]['pixelSize']
-                            result = download_image_from_formula(m.group('name'), context['tmp-dir'], row_height, nesting_level=nesting_level+1)
+                            result = download_image_from_formula(formula.image, context['asset-store'], row_height, nesting_level=nesting_level+1)
                             if result:
                                 worksheet_data['data'][0]['rowData'][row]['values'][val]['userEnteredValue']['image'] = result
 
                         # content can be a HYPERLINK/hyperlink to another worksheet
-                        m = re.match('=HYPERLINK\("#gid=(?P<ws_gid>.+)",\s*"(?P<ws_title>.+)"\)', formulaValue, re.IGNORECASE)
-                        if m and m.group('ws_gid') is not None and m.group('ws_title') is not None:
-                            new_section_data = {'section-prop': {'link': m.group('ws_title')}}
+                        elif formula.kind == FORMULA_WORKSHEET_LINK:
+                            new_section_data = {'section-prop': {'link': formula.title}}
                             cell_data['contents'] = process(gsheet=gsheet, section_data=new_section_data, context=context, current_document_index=current_document_index, nesting_level=nesting_level+1)
 
                         # content can be a HYPERLINK/hyperlink to another gdrive file (for now we only allow text only content, that is a text file)
-                        m = re.match('=HYPERLINK\("(?P<link_url>.+)",\s*"(?P<link_title>.+)"\)', formulaValue, re.IGNORECASE)
-                        if m and m.group('link_url') is not None and m.group('link_title') is not None:
-                            url = m.group('link_url')
-
-                            # this may be a drive file
-                            if url.startswith('https://drive.google.com/file/d/'):
-                                text = read_drive_file(url, context, nesting_level=nesting_level+1)
-                                if text is not None: cell_data['formattedValue'] = text
-
-                            # or it may be a web url
-                            elif url.startswith('http'):
-                                text = read_web_content(url, nesting_level=nesting_level+1)
-                                if text is not None: cell_data['formattedValue'] = text
+                        # or to a web url, these are fetched together (concurrently) once the rows are walked
+                        elif formula.kind in [FORMULA_DRIVE_LINK, FORMULA_WEB_LINK]:
+                            text_cells.append((cell_data, formula.url))
 
                 val = val + 1
         row = row + 1
 
+    if len(text_cells):
+        texts = GsheetHelper().fetch_texts(list(dict.fromkeys([url for _, url in text_cells])), nesting_level=nesting_level+1)
+        for cell_data, url in text_cells:
+            if texts.get(url) is not None: cell_data['formattedValue'] = texts[url]
+
+    in_progress.discard((gsheet.title, ws_title))
     context['worksheet-cache'][gsheet.title][ws_title] = worksheet_data
 
     return worksheet_data
@@ -9,24 +9,31 @@ import datetime
 import argparse
 from pathlib import Path
 
+# the modules shared by gsheet-to-json and the json-to-* backends are in shared/ at the root of the repository
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
 from context.context_helper import ContextHelper
 from context.context_util import *
 from helper.logger import *
+from shared.render_cache import RenderCache
+from shared.json_util import find_input_json, load_json_file
 
 
 class ContextFromJson(object):
 
-	def __init__(self, config_path, json=None):
+	def __init__(self, config_path, json=None, no_render_cache=False):
 		self.start_time = int(round(time.time() * 1000))
 		self._config_path = Path(config_path).resolve()
 		self._data = {}
 		self._json = json
+		self._no_render_cache = no_render_cache
+		self._render_cache = None
 
 	def run(self):
 		self.set_up()
 		# process jsons one by one
 		for json in self._CONFIG['jsons']:
-			self._CONFIG['files']['input-json'] = f"{self._CONFIG['dirs']['output-dir']}/{json}.json"
+			self._CONFIG['files']['input-json'] = find_input_json(self._CONFIG['dirs']['output-dir'], json)
 			self.load_json()
 
 			# context-helper
@@ -35,6 +42,9 @@ class ContextFromJson(object):
 			context_helper.generate_and_save(self._data['sections'])
 			self.tear_down()
 
+		if self._render_cache is not None:
+			self._render_cache.evict()
+
 	def set_up(self):
 		# configuration
 		self._CONFIG = yaml.load(open(self._config_path, 'r', encoding='utf-8'), Loader=yaml.FullLoader)
@@ -60,9 +70,20 @@ class ContextFromJson(object):
 		if not 'files' in self._CONFIG:
 			self._CONFIG['files'] = {}
 
+		# sections that have not changed (same fingerprint) since an earlier run are taken from the render cache
+		render_cache_config = self._CONFIG.get('render-cache', {})
+		if render_cache_config.get('enabled', True) and not self._no_render_cache:
+			source_dir = Path(__file__).resolve().parent / 'context'
+			self._render_cache = RenderCache(cache_dir=Path(self._CONFIG['dirs']['temp-dir']) / 'render-cache-context', config=self._CONFIG, source_files=[source_dir / 'context_api.py', source_dir / 'context_util.py'], max_size_mb=render_cache_config.get('max-size-mb', 200))
+		else:
+			self._render_cache = None
+
+		# the renderers find the cache in the configuration, apart from the render-cache settings
+		self._CONFIG['section-cache'] = self._render_cache
+
 	def load_json(self):
-		with open(self._CONFIG['files']['input-json'], "r") as f:
-			self._data = json.load(f)
+		# .json, .json.gz, .json.zst or .msgpack, by extension
+		self._data = load_json_file(self._CONFIG['files']['input-json'])
 
 	def tear_down(self):
 		self.end_time = int(round(time.time() * 1000))
@@ -73,7 +94,8 @@ if __name__ == '__main__':
 	ap = argparse.ArgumentParser()
 	ap.add_argument("-c", "--config", required=True, help="configuration yml path")
 	ap.add_argument("-j", "--json", required=False, help="json name to override json list provided in configuration")
+	ap.add_argument("--no-render-cache", required=False, action="store_true", help="render every section afresh, neither use nor update the render cache")
 	args = vars(ap.parse_args())
 
-	generator = ContextFromJson(args["config"], args["json"])
+	generator = ContextFromJson(args["config"], args["json"], no_render_cache=args["no_render_cache"])
 	generator.run()
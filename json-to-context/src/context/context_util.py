@@ -211,7 +211,14 @@ def section_list_to_context(section_list, config, color_dict, headers_footers, d
 
         module = importlib.import_module("context.context_api")
         func = getattr(module, f"process_{section_prop['content-type']}")
-        context_lines = context_lines + func(section_data=section, config=config, color_dict=color_dict, headers_footers=headers_footers, document_footnotes=document_footnotes, page_layouts=page_layouts)
+
+        # an unchanged section (same fingerprint) is taken from the render cache
+        render_cache = config.get('section-cache')
+        if render_cache is not None and section_meta.get('fingerprint'):
+            render = lambda **dicts: func(section_data=section, config=config, **dicts)
+            context_lines = context_lines + render_cache.render(section_meta['fingerprint'], render, {'color_dict': color_dict, 'headers_footers': headers_footers, 'document_footnotes': document_footnotes, 'page_layouts': page_layouts})
+        else:
+            context_lines = context_lines + func(section_data=section, config=config, color_dict=color_dict, headers_footers=headers_footers, document_footnotes=document_footnotes, page_layouts=page_layouts)
 
     return context_lines
 
@@ -9,9 +9,13 @@ import datetime
 import argparse
 from pathlib import Path
  
+# the modules shared by gsheet-to-json and the json-to-* backends are in shared/ at the root of the repository
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
 from doc.doc_helper import DocHelper
 from doc.doc_util import *
 from helper.logger import *
+from shared.json_util import find_input_json, load_json_file
 
 
 class DocFromJson(object):
@@ -27,7 +31,7 @@ class DocFromJson(object):
 		self.set_up()
 		# process jsons one by one
 		for json in self._CONFIG['jsons']:
-			self._CONFIG['files']['input-json'] = f"{self._CONFIG['dirs']['output-dir']}/{json}.json"
+			self._CONFIG['files']['input-json'] = find_input_json(self._CONFIG['dirs']['output-dir'], json)
 			self.load_json()
 
 			# doc-helper
@@ -72,8 +76,8 @@ class DocFromJson(object):
 
 
 	def load_json(self):
-		with open(self._CONFIG['files']['input-json'], "r") as f:
-			self._data = json.load(f)
+		# .json, .json.gz, .json.zst or .msgpack, by extension
+		self._data = load_json_file(self._CONFIG['files']['input-json'])
 
 
 	def tear_down(self):
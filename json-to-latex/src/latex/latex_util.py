@@ -186,7 +186,14 @@ def section_list_to_latex(section_list, config, color_dict, headers_footers, doc
 
         module = importlib.import_module("latex.latex_api")
         func = getattr(module, f"process_{section_prop['content-type']}")
-        section_lines = section_lines + func(section_data=section, config=config, color_dict=color_dict, headers_footers=headers_footers, document_footnotes=document_footnotes)
+
+        # an unchanged section (same fingerprint) is taken from the render cache
+        render_cache = config.get('section-cache')
+        if render_cache is not None and section_meta.get('fingerprint'):
+            render = lambda **dicts: func(section_data=section, config=config, **dicts)
+            section_lines = section_lines + render_cache.render(section_meta['fingerprint'], render, {'color_dict': color_dict, 'headers_footers': headers_footers, 'document_footnotes': document_footnotes})
+        else:
+            section_lines = section_lines + func(section_data=section, config=config, color_dict=color_dict, headers_footers=headers_footers, document_footnotes=document_footnotes)
 
     return section_lines
 
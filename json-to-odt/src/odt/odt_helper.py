@@ -10,6 +10,8 @@ import datetime
 from odf import opendocument
 
 from odt.odt_util import *
+from odt.odt_writer import OdtStreamWriter
+from odt.odt_section_pool import OdtSectionPool
 from helper.logger import *
 
 class OdtHelper(object):
@@ -27,16 +29,46 @@ class OdtHelper(object):
     def generate_and_save(self, section_list):
         self.start_time = int(round(time.time() * 1000))
 
+        # stream the body of the odt out section by section so that only the section being generated is in memory, opted in through the
+        # config - the odt is saved through odfpy internals then
+        odt_writer = None
+        if self._config['odt-related'].get('stream-content', False):
+            body_path = f"{self._config['dirs']['temp-dir']}/{Path(self._config['files']['output-odt']).stem}.content.xml"
+            odt_writer = OdtStreamWriter(self._odt, body_path)
+            self._config['odt-writer'] = odt_writer
+
+        # render sections in a pool of processes and/or through the render cache, they are merged into the odt in order
+        section_pool = None
+        section_workers = self._config['odt-related'].get('section-workers', 0)
+        if section_workers > 1 or self._config.get('section-cache') is not None:
+            section_pool = OdtSectionPool(self._config, section_workers)
+            self._config['section-pool'] = section_pool
+
         # process the sections
         section_list_to_odt(section_list, self._config)
 
+        if section_pool is not None:
+            section_pool.close()
+            self._config['section-pool'] = None
+
         self.end_time = int(round(time.time() * 1000))
         debug(msg=f"generating odt .. done {(self.end_time - self.start_time)/1000} seconds")
 
+        style_registry = get_style_registry(self._odt)
+        debug(msg=f"automatic styles .. {style_registry.created} created, {style_registry.reused} reused")
+
+        picture_registry = get_picture_registry(self._odt)
+        debug(msg=f"pictures .. {picture_registry.added} added, {picture_registry.reused} reused")
+
         # save the odt document
         debug(msg=f"saving odt .. {Path(self._config['files']['output-odt']).resolve()}")
         self.start_time = int(round(time.time() * 1000))
-        self._odt.save(self._config['files']['output-odt'])
+        if odt_writer is not None:
+            odt_writer.save(self._config['files']['output-odt'])
+            self._config['odt-writer'] = None
+        else:
+            self._odt.save(self._config['files']['output-odt'])
+
         self.end_time = int(round(time.time() * 1000))
         debug(msg=f"saving odt .. done {(self.end_time - self.start_time)/1000} seconds")
 
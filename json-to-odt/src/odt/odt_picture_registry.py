@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+''' picture registry for an odt document
+'''
+import hashlib
+
+from helper.logger import *
+
+
+''' pictures of an odt document key'ed by their content, a picture that is added again (from the same path or from another file with the
+    same content) gets the href of the one already there instead of another copy in Pictures/
+'''
+class PictureRegistry(object):
+
+    ''' constructor
+    '''
+    def __init__(self, odt):
+        self._odt = odt
+
+        # path -> href so that a path is read (hashed) once, digest -> href so that a content is stored once
+        self._hrefs_by_path = {}
+        self._hrefs_by_digest = {}
+        self._digests_by_href = {}
+        self.added = 0
+        self.reused = 0
+
+
+    ''' href of the picture at a path, the picture is added to the document only if there is no picture with the same content yet
+    '''
+    def href(self, picture_path):
+        href = self._hrefs_by_path.get(picture_path)
+        if href is not None:
+            self.reused = self.reused + 1
+            return href
+
+        digest = file_digest(picture_path)
+        if digest is None:
+            # odfpy reports a file it can not read when the odt is saved, as it did before pictures were registered
+            return self._odt.addPicture(picture_path)
+
+        href = self._hrefs_by_digest.get(digest)
+        if href is not None:
+            self.reused = self.reused + 1
+        else:
+            href = self._odt.addPicture(picture_path)
+            self._hrefs_by_digest[digest] = href
+            self._digests_by_href[href] = digest
+            self.added = self.added + 1
+
+        self._hrefs_by_path[picture_path] = href
+
+        return href
+
+
+    ''' digest of the picture behind an href, None if the picture was not added through the registry
+    '''
+    def digest(self, href):
+        return self._digests_by_href.get(href)
+
+
+    ''' add a picture added elsewhere (a section rendered in the section pool) under its href, unless the same content is already there
+        returns the href the picture is to be referred to by
+    '''
+    def add(self, href, digest, picture):
+        if digest is not None and digest in self._hrefs_by_digest:
+            self.reused = self.reused + 1
+            return self._hrefs_by_digest[digest]
+
+        self._odt.Pictures[href] = picture
+        if digest is not None:
+            self._hrefs_by_digest[digest] = href
+            self._digests_by_href[href] = digest
+
+        self.added = self.added + 1
+
+        return href
+
+
+
+''' the registry of an odt document, created when it is first asked for
+'''
+def get_picture_registry(odt):
+    registry = getattr(odt, 'picture_registry', None)
+    if registry is None:
+        registry = PictureRegistry(odt)
+        odt.picture_registry = registry
+
+    return registry
+
+
+
+''' sha256 of a file's content, None if the file can not be read
+'''
+def file_digest(path):
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(DIGEST_CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+    except OSError as e:
+        warn(f"picture {path} could not be read: {e}")
+        return None
+
+    return digest.hexdigest()
+
+
+
+# bytes of a picture read at a time while hashing
+DIGEST_CHUNK_SIZE = 1024 * 1024
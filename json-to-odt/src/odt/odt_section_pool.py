@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+''' renders sections in a pool of processes (or through the render cache) and merges them into the odt in order
+'''
+import copy
+import random
+import importlib
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from odf import opendocument
+from odf.element import Element, Node
+from odf.namespaces import STYLENS, XLINKNS
+
+from helper.logger import *
+from odt.odt_style_registry import get_style_registry
+from odt.odt_picture_registry import get_picture_registry
+from odt.odt_writer import STYLE_REFERENCES
+
+
+''' sections are sent to worker processes as they come and merged into the odt in the order they were sent,
+    each worker renders a section into a fresh copy of the template (loaded once per worker) and sends back what the section produced as plain data
+    (the body, the automatic styles, page-layouts and master-pages as element tuples and the pictures), never odfpy elements
+    sections that change what is already in the document are rendered in this process - see can_render
+    what a worker sends back depends only on the section, the config and the template, so it is what the render cache keeps for a section
+    with fewer than 2 workers there are no worker processes, sections the render cache does not have are rendered the same way in this process
+'''
+class OdtSectionPool(object):
+
+    ''' constructor
+    '''
+    def __init__(self, config, workers):
+        self._config = config
+        self._workers = workers
+
+        # what a worker needs of the config, the document, the writer and the render cache stay here
+        worker_config = {k: v for k, v in config.items() if k not in ['odt', 'odt-writer', 'section-pool', 'section-cache']}
+        if workers > 1:
+            self._executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(worker_config,))
+        else:
+            self._executor = None
+            init_worker(worker_config)
+
+        # sections sent and not yet merged, in order - (future, render cache path the result is to be stored at)
+        self._pending = []
+        self.rendered = 0
+        self.cached = 0
+
+
+    ''' whether a section can be rendered in a worker
+        a gsheet section renders its own sections through section_list_to_odt (they are sent to the pool from there) and the very first
+        section changes the Standard master-page of the template, both are rendered in this process
+        without worker processes only sections the render cache can keep (those with a fingerprint) are taken
+    '''
+    def can_render(self, section):
+        section_meta = section['section-meta']
+        if section['section-prop']['content-type'] == 'gsheet':
+            return False
+
+        if section_meta['first-section'] and section_meta['document-index'] == 0:
+            return False
+
+        if self._executor is None:
+            return self._config.get('section-cache') is not None and bool(section_meta.get('fingerprint'))
+
+        return True
+
+
+    ''' send a section to the pool, the oldest sections are merged when too many are waiting (their results are held in memory until merged)
+        an unchanged section (same fingerprint, at the same place in the document) is taken from the render cache instead
+    '''
+    def submit(self, section):
+        render_cache = self._config.get('section-cache')
+        fingerprint = section['section-meta'].get('fingerprint')
+        if render_cache is not None and fingerprint:
+            # the style names and the random names of a section follow its place in the document
+            cache_path = render_cache.path(f"{fingerprint}|{section_id(section)}|{section['section-meta']['first-section']}")
+            result = render_cache.get(cache_path)
+            if result is not None:
+                future = Future()
+                future.set_result(result)
+                self._pending.append((future, None))
+                self.cached = self.cached + 1
+            else:
+                self._pending.append((self.render(section), cache_path))
+
+        else:
+            self._pending.append((self.render(section), None))
+
+        while len(self._pending) > self._workers * PENDING_PER_WORKER:
+            self.merge_next()
+
+
+    ''' render a section in a worker, or in this process when there are no workers - the random names drawn in this process stay as they
+        would be without the section
+    '''
+    def render(self, section):
+        if self._executor is not None:
+            return self._executor.submit(render_section, section)
+
+        future = Future()
+        random_state = random.getstate()
+        try:
+            future.set_result(render_section(section))
+        finally:
+            random.setstate(random_state)
+
+        return future
+
+
+    ''' merge the oldest section sent, waiting for it if it is not rendered yet
+    '''
+    def merge_next(self):
+        future, cache_path = self._pending.pop(0)
+        result = future.result()
+        if cache_path is not None:
+            self._config['section-cache'].put(cache_path, result)
+
+        merge_section(self._config['odt'], self._config.get('odt-writer'), result)
+        self.rendered = self.rendered + 1
+
+
+    ''' merge every section sent so far, anything rendered in this process after this comes after them
+    '''
+    def merge(self):
+        while len(self._pending) > 0:
+            self.merge_next()
+
+
+    ''' merge what is left and stop the workers
+    '''
+    def close(self):
+        self.merge()
+        if self._executor is not None:
+            self._executor.shutdown()
+            debug(msg=f"section pool .. {self.rendered} sections rendered in {self._workers} workers, {self.cached} of them from the render cache")
+        else:
+            debug(msg=f"section pool .. {self.rendered} sections rendered in this process, {self.cached} of them from the render cache")
+
+
+
+''' worker process - keep the config and load the template, every section is rendered into a copy of it
+'''
+def init_worker(config):
+    global WORKER_CONFIG, WORKER_TEMPLATE
+    WORKER_CONFIG = config
+    WORKER_TEMPLATE = opendocument.load(config['files']['odt-template'])
+
+    # the body of the template stays in the document being merged into
+    WORKER_TEMPLATE.text.childNodes = []
+
+
+
+''' worker process - render a section into a fresh copy of the template and return what it produced
+'''
+def render_section(section):
+    config = WORKER_CONFIG
+    odt = copy.deepcopy(WORKER_TEMPLATE)
+    config['odt'] = odt
+
+    automatic_style_count = len(odt.automaticstyles.childNodes)
+    master_page_count = len(odt.masterstyles.childNodes)
+    template_pictures = set(odt.Pictures)
+
+    # style names are namespaced by the section so that sections rendered in different workers do not clash, random names (tables) are
+    # seeded by the section as workers forked from the same process would otherwise draw the same names
+    style_registry = get_style_registry(odt)
+    style_registry.name_prefix = f"{section_id(section)}-"
+    random.seed(section_id(section))
+
+    module = importlib.import_module("odt.odt_api")
+    func = getattr(module, f"process_{section['section-prop']['content-type']}")
+    func(section, config)
+
+    return {
+        'body'              : [element_tuple(e) for e in odt.text.childNodes if e.nodeType == Node.ELEMENT_NODE],
+        'automatic-styles'  : [element_tuple(e) for e in odt.automaticstyles.childNodes[automatic_style_count:]],
+        'master-pages'      : [element_tuple(e) for e in odt.masterstyles.childNodes[master_page_count:]],
+        'pictures'          : {name: picture for name, picture in odt.Pictures.items() if name not in template_pictures},
+        'picture-digests'   : {name: get_picture_registry(odt).digest(name) for name in odt.Pictures if name not in template_pictures},
+        'namespaces'        : list(Element.namespaces.keys()),
+        'styles-reused'     : style_registry.reused,
+        'pictures-reused'   : get_picture_registry(odt).reused,
+    }
+
+
+
+''' merge a rendered section into the odt - its pictures, styles, page-layouts and master-pages and body
+    the section's styles are namespaced by the section, a style the document already has (the same style under another name) is referred to
+    by the name it has here - in the body, the other styles and the master-pages - as a picture it already has is referred to by its href
+    the names are changed in the element tuples (only in the attributes that refer to a picture or a style) before they become elements
+    the body goes into office:text, and out to the body file right away when the odt is streamed
+'''
+def merge_section(odt, odt_writer, result):
+    # the document-content tag of content.xml declares the namespaces odfpy has seen in this process
+    for namespace in result['namespaces']:
+        odt.text.get_nsprefix(namespace)
+
+    # a picture the document already has (the same content) is referred to by the href it has here
+    picture_registry = get_picture_registry(odt)
+    hrefs = {}
+    for href, picture in result['pictures'].items():
+        merged_href = picture_registry.add(href, result['picture-digests'][href], picture)
+        if merged_href != href:
+            hrefs[href] = merged_href
+
+    # a style may refer to the styles before it, those are renamed by the time it is interned
+    style_registry = get_style_registry(odt)
+    names = {}
+    for automatic_style in result['automatic-styles']:
+        automatic_style = element_from_tuple(automatic_style, hrefs, names)
+        if automatic_style.qname == (STYLENS, 'page-layout'):
+            style_registry.add_page_layout(automatic_style)
+        else:
+            name = automatic_style.getAttribute('name')
+            merged_name = style_registry.intern_style(automatic_style)
+            if merged_name != name:
+                names[name] = merged_name
+
+    for master_page in result['master-pages']:
+        style_registry.add_master_page(element_from_tuple(master_page, hrefs, names))
+
+    for element_data in result['body']:
+        odt.text.addElement(element_from_tuple(element_data, hrefs, names), check_grammar=False)
+
+    if odt_writer is not None:
+        odt_writer.flush()
+
+    picture_registry.reused = picture_registry.reused + result['pictures-reused']
+    style_registry.reused = style_registry.reused + result['styles-reused']
+
+
+
+''' a section's place in the document - D<document-index>--S<section-index>
+'''
+def section_id(section):
+    section_meta = section['section-meta']
+    return f"D{str(section_meta['document-index']).zfill(3)}--S{str(section_meta['section-index']).zfill(3)}"
+
+
+
+''' an element as plain data - (qname, attributes, children) with text children as strings
+'''
+def element_tuple(element):
+    children = []
+    for child in element.childNodes:
+        if child.nodeType == Node.ELEMENT_NODE:
+            children.append(element_tuple(child))
+        elif child.nodeType in [Node.TEXT_NODE, Node.CDATA_SECTION_NODE]:
+            children.append(child.data)
+
+    return (element.qname, dict(element.attributes), children)
+
+
+
+''' the element back from its plain data, with the pictures in hrefs (href -> href) and the styles in names (name -> name) it refers to
+    changed
+'''
+def element_from_tuple(element_data, hrefs, names):
+    qname, attributes, children = element_data
+    element = Element(qname=qname, check_grammar=False)
+    for namespace, localpart in attributes.keys():
+        element.get_nsprefix(namespace)
+
+    element.attributes = {k: renamed(k, v, hrefs, names) for k, v in attributes.items()}
+    for child in children:
+        if isinstance(child, str):
+            element.addText(child, check_grammar=False)
+        else:
+            element.addElement(element_from_tuple(child, hrefs, names), check_grammar=False)
+
+    return element
+
+
+
+''' an attribute value as it is after the merge - a picture href or a style name if the attribute refers to one, the value otherwise
+'''
+def renamed(attribute, value, hrefs, names):
+    if attribute == (XLINKNS, 'href'):
+        return hrefs.get(value, value)
+
+    if attribute in STYLE_NAME_ATTRIBUTES:
+        return names.get(value, value)
+
+    return value
+
+
+
+# the config of a worker process and the template it renders sections into copies of
+WORKER_CONFIG = None
+WORKER_TEMPLATE = None
+
+# attributes through which an element refers to a style - those odfpy looks at in the body, and those through which a style refers to another
+STYLE_NAME_ATTRIBUTES = set(STYLE_REFERENCES + [(STYLENS, 'parent-style-name'), (STYLENS, 'next-style-name')])
+
+# how many sections per worker may wait to be merged before the oldest is waited for
+PENDING_PER_WORKER = 2
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+''' automatic style registry for an odt document
+'''
+from odf import style
+from odf.namespaces import STYLENS
+
+from helper.logger import *
+
+
+''' automatic styles of an odt document key'ed by what they are (family, parent, master-page and their properties) rather than by name,
+    a style that is asked for again gets the name of the one already there instead of a new one in odt.automaticstyles
+    styles, page-layouts and master-pages are also indexed by name as they are created, a lookup never walks the document
+'''
+class StyleRegistry(object):
+
+    ''' constructor
+    '''
+    def __init__(self, odt):
+        self._odt = odt
+        self._names = {}
+        # the same, key'ed by the style element (see element_style_key) for the styles merged from the section pool
+        self._names_by_element = {}
+        self.created = 0
+        self.reused = 0
+
+        # put before the names of the styles created, a section rendered in the section pool namespaces its styles by the section
+        self.name_prefix = ''
+
+        # name -> element, styles/page-layouts/master-pages of the template are indexed the first time one is asked for and not found
+        self._styles = {}
+        self._page_layouts = {}
+        self._master_pages = {}
+        self._template_indexed = False
+
+
+    ''' name of the automatic style with the given style attributes and properties, the style is created (under the name in style_attributes)
+        only if there is no such style yet
+        properties is a list of (properties element function, attributes, child elements) like (style.TableCellProperties, {...}, [background_image])
+    '''
+    def style_name(self, style_attributes, properties):
+        key = style_key(style_attributes, properties)
+        name = self._names.get(key)
+        if name is not None:
+            self.reused = self.reused + 1
+            return name
+
+        if self.name_prefix != '':
+            style_attributes = {**style_attributes, 'name': f"{self.name_prefix}{style_attributes['name']}"}
+
+        new_style = style.Style(attributes=style_attributes)
+        for properties_element, properties_attributes, child_elements in properties:
+            properties_element = properties_element(attributes=properties_attributes)
+            for child_element in child_elements:
+                properties_element.addElement(child_element)
+
+            new_style.addElement(properties_element)
+
+        self._odt.automaticstyles.addElement(new_style)
+
+        name = new_style.getAttribute('name')
+        self._names[key] = name
+        self._names_by_element.setdefault(element_style_key(new_style), name)
+        self._styles[name] = new_style
+        self.created = self.created + 1
+
+        return name
+
+
+    ''' style by name, None if there is no such style
+    '''
+    def get_style(self, name):
+        if name not in self._styles:
+            # a template style, odfpy keeps them in a dict of its own
+            found = self._odt.getStyleByName(name)
+            if found is None:
+                return None
+
+            self._styles[name] = found
+
+        return self._styles[name]
+
+
+    ''' name of a style created elsewhere (a section rendered in the section pool), the style is added to odt.automaticstyles only if
+        there is no such style yet - the same as style_name does for the styles created here
+    '''
+    def intern_style(self, new_style):
+        key = element_style_key(new_style)
+        name = self._names_by_element.get(key)
+        if name is not None:
+            self.reused = self.reused + 1
+            return name
+
+        self._odt.automaticstyles.addElement(new_style)
+
+        name = new_style.getAttribute('name')
+        self._names_by_element[key] = name
+        self._styles[name] = new_style
+        self.created = self.created + 1
+
+        return name
+
+
+    ''' add a page-layout to odt.automaticstyles
+    '''
+    def add_page_layout(self, page_layout):
+        self._odt.automaticstyles.addElement(page_layout)
+        self._page_layouts[page_layout.getAttribute('name')] = page_layout
+
+
+    ''' add a master-page to odt.masterstyles
+    '''
+    def add_master_page(self, master_page):
+        self._odt.masterstyles.addElement(master_page)
+        self._master_pages[master_page.getAttribute('name')] = master_page
+
+
+    ''' page-layout by name, None if there is no such page-layout
+    '''
+    def get_page_layout(self, name):
+        if name not in self._page_layouts:
+            self.index_template()
+
+        return self._page_layouts.get(name)
+
+
+    ''' master-page by name, None if there is no such master-page
+    '''
+    def get_master_page(self, name):
+        if name not in self._master_pages:
+            self.index_template()
+
+        return self._master_pages.get(name)
+
+
+    ''' index the page-layouts and master-pages that came with the template, once
+    '''
+    def index_template(self):
+        if self._template_indexed:
+            return
+
+        self._template_indexed = True
+        for page_layout in self._odt.automaticstyles.getElementsByType(style.PageLayout):
+            self._page_layouts.setdefault(page_layout.getAttribute('name'), page_layout)
+
+        for master_page in self._odt.masterstyles.getElementsByType(style.MasterPage):
+            self._master_pages.setdefault(master_page.getAttribute('name'), master_page)
+
+
+
+''' the registry of an odt document, created when it is first asked for
+'''
+def get_style_registry(odt):
+    registry = getattr(odt, 'style_registry', None)
+    if registry is None:
+        registry = StyleRegistry(odt)
+        odt.style_registry = registry
+
+    return registry
+
+
+
+''' what makes two automatic styles the same - every style attribute but the name, and the properties with their attributes and child elements
+'''
+def style_key(style_attributes, properties):
+    return (
+        attributes_key({k: v for k, v in style_attributes.items() if k != 'name'}),
+        tuple((properties_element.__name__, attributes_key(properties_attributes), tuple(element_key(e) for e in child_elements)) for properties_element, properties_attributes, child_elements in properties),
+    )
+
+
+
+''' what makes two automatic style elements the same - the element with every attribute but its name
+'''
+def element_style_key(element):
+    return (element.qname, attributes_key({k: v for k, v in element.attributes.items() if k != (STYLENS, 'name')}), tuple(element_key(e) for e in element.childNodes if e.nodeType == e.ELEMENT_NODE))
+
+
+
+''' hashable form of an attributes dict
+'''
+def attributes_key(attributes):
+    if attributes is None:
+        return ()
+
+    return tuple(sorted((str(k), str(v)) for k, v in attributes.items()))
+
+
+
+''' hashable form of an element - its name, attributes and child elements
+'''
+def element_key(element):
+    return (element.qname, attributes_key(element.attributes), tuple(element_key(e) for e in element.childNodes if e.nodeType == e.ELEMENT_NODE))
@@ -19,6 +19,8 @@ from xml.dom.minidom import parseString
 from xml.dom import Node
 import latex2mathml.converter
 from helper.logger import *
+from odt.odt_style_registry import get_style_registry
+from odt.odt_picture_registry import get_picture_registry
 
 host = "localhost"
 port = 8100
@@ -40,6 +42,7 @@ else:
 ''' process a list of section_data and generate odt code
 '''
 def section_list_to_odt(section_list, config):
+    section_pool = config.get('section-pool')
     first_section = True
     for section in section_list:
         section_meta = section['section-meta']
@@ -56,10 +59,22 @@ def section_list_to_odt(section_list, config):
             first_section = False
 
 
+        if section_pool is not None:
+            if section_pool.can_render(section):
+                section_pool.submit(section)
+                continue
+
+            # what is rendered here goes after the sections already sent to the pool
+            section_pool.merge()
+
         module = importlib.import_module("odt.odt_api")
         func = getattr(module, f"process_{section_prop['content-type']}")
         func(section, config)
 
+        # when the odt is streamed, what the section has written goes out of the document now
+        if config.get('odt-writer') is not None:
+            config['odt-writer'].flush()
+
 
 
 # --------------------------------------------------------------------------------------------------------------------------------------------
@@ -82,8 +97,8 @@ def section_list_to_odt(section_list, config):
 def create_background_image_style(odt, picture_path):
     background_image_style = None
 
-    # first the image to be added into the document
-    href = odt.addPicture(picture_path)
+    # first the image to be added into the document (once, however many times it is used)
+    href = get_picture_registry(odt).href(picture_path)
     if href:
         background_image_style_attributes = {'href': href, 'opacity': '100%', 'position': 'center', 'repeat': 'tile', }
         # background_image_style_attributes = {'href': href}
@@ -104,15 +119,10 @@ def create_graphic_style(odt, valign, halign):
     style_name = f"fr-{random_string()}"
 
     graphic_properties_attributes = {'wrap': 'none', 'verticalpos': valign, 'horizontalpos': halign}
-    graphic_properties = style.GraphicProperties(attributes=graphic_properties_attributes)
-
     graphic_style_attributes = {'name': style_name, 'family': 'graphic', 'parentstylename': 'Graphics'}
-    graphic_style = style.Style(attributes=graphic_style_attributes)
-
-    graphic_style.addElement(graphic_properties)
-    odt.automaticstyles.addElement(graphic_style)
 
-    return style_name
+    # frames with the same alignment share one style
+    return get_style_registry(odt).style_name(graphic_style_attributes, [(style.GraphicProperties, graphic_properties_attributes, [])])
 
 
 
@@ -125,8 +135,8 @@ def create_image_frame(odt, picture_path, valign, halign, width, height):
     # THIS IS THE Draw:Frame object to return
     draw_frame = None
 
-    # first the image to be added into the document
-    href = odt.addPicture(picture_path)
+    # first the image to be added into the document (once, however many times it is used)
+    href = get_picture_registry(odt).href(picture_path)
     if href:
         # next we need the Draw:Image object
         image_attributes = {'href': href}
@@ -157,13 +167,11 @@ def create_table(odt, table_name, table_style_attributes, table_properties_attri
     if 'family' not in table_style_attributes:
         table_style_attributes['family'] = 'table'
 
-    # create the style
-    table_style = style.Style(attributes=table_style_attributes)
-    table_style.addElement(style.TableProperties(attributes=table_properties_attributes))
-    odt.automaticstyles.addElement(table_style)
+    # create (or reuse) the style
+    table_style_name = get_style_registry(odt).style_name(table_style_attributes, [(style.TableProperties, table_properties_attributes, [])])
 
     # create the table
-    table_properties = {'name': table_name, 'stylename': table_style_attributes['name']}
+    table_properties = {'name': table_name, 'stylename': table_style_name}
     tbl = table.Table(attributes=table_properties)
 
     return tbl
@@ -183,13 +191,11 @@ def create_table_column(odt, table_column_name, table_column_style_attributes, t
     if 'family' not in table_column_style_attributes:
         table_column_style_attributes['family'] = 'table-column'
 
-    # create the style
-    table_column_style = style.Style(attributes=table_column_style_attributes)
-    table_column_style.addElement(style.TableColumnProperties(attributes=table_column_properties_attributes))
-    odt.automaticstyles.addElement(table_column_style)
+    # create (or reuse) the style
+    table_column_style_name = get_style_registry(odt).style_name(table_column_style_attributes, [(style.TableColumnProperties, table_column_properties_attributes, [])])
 
     # create the table-column
-    table_column_properties = {'stylename': table_column_style_attributes['name']}
+    table_column_properties = {'stylename': table_column_style_name}
     table_column = table.TableColumn(attributes=table_column_properties)
 
     return table_column
@@ -202,14 +208,12 @@ def create_table_row(odt, table_row_style_attributes, table_row_properties_attri
     if 'family' not in table_row_style_attributes:
         table_row_style_attributes['family'] = 'table-row'
 
-    # create the style
-    table_row_style = style.Style(attributes=table_row_style_attributes)
+    # create (or reuse) the style
     table_row_properties_attributes['keeptogether'] = 'always'
-    table_row_style.addElement(style.TableRowProperties(attributes=table_row_properties_attributes))
-    odt.automaticstyles.addElement(table_row_style)
+    table_row_style_name = get_style_registry(odt).style_name(table_row_style_attributes, [(style.TableRowProperties, table_row_properties_attributes, [])])
 
     # create the table-row
-    table_row_properties = {'stylename': table_row_style_attributes['name']}
+    table_row_properties = {'stylename': table_row_style_name}
     table_row = table.TableRow(attributes=table_row_properties)
 
     return table_row
@@ -222,18 +226,15 @@ def create_table_cell(odt, table_cell_style_attributes, table_cell_properties_at
     if 'family' not in table_cell_style_attributes:
         table_cell_style_attributes['family'] = 'table-cell'
 
-    # create the style
-    table_cell_style = style.Style(attributes=table_cell_style_attributes)
-    table_cell_properties = style.TableCellProperties(attributes=table_cell_properties_attributes)
-
+    # create (or reuse) the style
+    table_cell_properties_children = []
     if background_image_style:
-        table_cell_properties.addElement(background_image_style)
+        table_cell_properties_children.append(background_image_style)
 
-    table_cell_style.addElement(table_cell_properties)
-    odt.automaticstyles.addElement(table_cell_style)
+    table_cell_style_name = get_style_registry(odt).style_name(table_cell_style_attributes, [(style.TableCellProperties, table_cell_properties_attributes, table_cell_properties_children)])
 
     # create the table-cell
-    table_cell_attributes['stylename'] = table_cell_style_attributes['name']
+    table_cell_attributes['stylename'] = table_cell_style_name
     table_cell = table.TableCell(attributes=table_cell_attributes)
 
     return table_cell
@@ -246,13 +247,11 @@ def create_covered_table_cell(odt, table_cell_style_attributes, table_cell_prope
     if 'family' not in table_cell_style_attributes:
         table_cell_style_attributes['family'] = 'table-cell'
 
-    # create the style
-    table_cell_style = style.Style(attributes=table_cell_style_attributes)
-    table_cell_style.addElement(style.TableCellProperties(attributes=table_cell_properties_attributes))
-    odt.automaticstyles.addElement(table_cell_style)
+    # create (or reuse) the style
+    table_cell_style_name = get_style_registry(odt).style_name(table_cell_style_attributes, [(style.TableCellProperties, table_cell_properties_attributes, [])])
 
     # create the table-cell
-    table_cell_attributes = {'stylename': table_cell_style_attributes['name']}
+    table_cell_attributes = {'stylename': table_cell_style_name}
     table_cell = table.CoveredTableCell(attributes=table_cell_attributes)
 
     return table_cell
@@ -278,18 +277,15 @@ def create_paragraph_style(odt, style_attributes=None, paragraph_attributes=None
     if 'parentstylename' not in style_attributes:
         style_attributes['parentstylename'] = 'Text_20_body'
 
-    # create the style
-    paragraph_style = style.Style(attributes=style_attributes)
-
+    properties = []
     if paragraph_attributes is not None:
-        paragraph_style.addElement(style.ParagraphProperties(attributes=paragraph_attributes))
+        properties.append((style.ParagraphProperties, paragraph_attributes, []))
 
     if text_attributes is not None:
-        paragraph_style.addElement(style.TextProperties(attributes=text_attributes))
-
-    odt.automaticstyles.addElement(paragraph_style)
+        properties.append((style.TextProperties, text_attributes, []))
 
-    return paragraph_style.getAttribute('name')
+    # create the style, unless there is one just like it already
+    return get_style_registry(odt).style_name(style_attributes, properties)
 
 
 
@@ -323,7 +319,7 @@ def create_page_number(style_name, page_numbering='long'):
 ''' write a paragraph in a given style
 '''
 def create_paragraph(odt, style_name, text_content=None, run_list=None, outline_level=0, footnote_list={}, keep_line_breaks=False):
-    style = odt.getStyleByName(style_name)
+    style = get_style_registry(odt).get_style(style_name)
     if style is None:
         warn(f"style {style_name} not found")
 
@@ -521,7 +517,7 @@ def create_latex(latex_content):
 '''
 def create_mathml(odt, style_name, latex_content):
     # process styles
-    style = odt.getStyleByName(style_name)
+    style = get_style_registry(odt).get_style(style_name)
     if style is None:
         warn(f"style {style_name} not found")
 
@@ -718,24 +714,22 @@ def create_lot():
 ''' get master-page by name
 '''
 def get_master_page(odt, master_page_name):
-    for master_page in odt.masterstyles.getElementsByType(style.MasterPage):
-        if master_page.getAttribute('name') == master_page_name:
-            return master_page
+    master_page = get_style_registry(odt).get_master_page(master_page_name)
+    if master_page is None:
+        warn(f"master-page {master_page_name} NOT found")
 
-    warn(f"master-page {master_page_name} NOT found")
-    return None
+    return master_page
 
 
 
 ''' get page-layout by name
 '''
 def get_page_layout(odt, page_layout_name):
-    for page_layout in odt.automaticstyles.getElementsByType(style.PageLayout):
-        if page_layout.getAttribute('name') == page_layout_name:
-            return page_layout
+    page_layout = get_style_registry(odt).get_page_layout(page_layout_name)
+    if page_layout is None:
+        warn(f"page-layout {page_layout_name} NOT found")
 
-    warn(f"page-layout {page_layout_name} NOT found")
-    return None
+    return page_layout
 
 
 
@@ -760,7 +754,7 @@ def update_master_page_page_layout(odt, master_page_name, new_page_layout_name):
 def create_page_layout(odt, odt_specs, page_layout_name, page_spec, margin_spec, orientation, background_image_path):
     # create one
     page_layout = style.PageLayout(name=page_layout_name)
-    odt.automaticstyles.addElement(page_layout)
+    get_style_registry(odt).add_page_layout(page_layout)
 
     if orientation == 'portrait':
         pageheight = f"{odt_specs['page-spec'][page_spec]['height']}in"
@@ -821,7 +815,7 @@ def create_master_page(odt, odt_specs, master_page_name, page_layout_name, page_
     # create one, first get/create the page-layout
     page_layout = create_page_layout(odt, odt_specs, page_layout_name, page_spec, margin_spec, orientation, background_image_path)
     master_page = style.MasterPage(name=master_page_name, pagelayoutname=page_layout_name)
-    odt.masterstyles.addElement(master_page)
+    get_style_registry(odt).add_master_page(master_page)
 
     return master_page
 
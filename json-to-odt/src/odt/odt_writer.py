@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+''' streaming writer for an odt document
+'''
+import io
+import os
+import time
+import zipfile
+
+from odf import manifest
+from odf.element import Node
+from odf.namespaces import CHARTNS, DRAWNS, PRESENTATIONNS, STYLENS, TABLENS, TEXTNS, TOOLSVERSION
+from odf.office import AutomaticStyles, DocumentContent
+from odf.opendocument import UNIXPERMS
+
+from helper.logger import *
+
+
+''' writes the body of an odt document (office:text) out to a file section by section instead of keeping the whole element tree in memory,
+    the document keeps only its styles, master-pages, pictures and whatever the section being generated has added so far
+    content.xml is put together from that file when the odt is saved, styles.xml and the rest are written as odfpy writes them
+'''
+class OdtStreamWriter(object):
+
+    ''' constructor
+    '''
+    def __init__(self, odt, body_path):
+        check_odfpy(odt)
+        self._odt = odt
+        self._body_path = body_path
+        self._body_file = open(self._body_path, 'w', encoding='utf-8')
+
+        # names of the styles the flushed elements refer to, the automatic styles of content.xml are chosen by these
+        self._style_names = set()
+        self.flushed = 0
+
+
+    ''' write the elements in office:text out to the body file and take them out of the document
+    '''
+    def flush(self):
+        children = self._odt.text.childNodes
+        if len(children) == 0:
+            return
+
+        flushed_ids = {}
+        for child in children:
+            child.toXml(3, self._body_file)
+            if child.nodeType == Node.ELEMENT_NODE:
+                collect_style_names(child, self._style_names)
+                collect_element_ids(child, flushed_ids)
+
+            child.parentNode = None
+            child.previousSibling = None
+            child.nextSibling = None
+
+        self.flushed = self.flushed + len(children)
+        self._odt.text.childNodes = []
+
+        # odfpy keeps every element it has seen in odt.element_dict (for odt.getElementsByType), that would keep the flushed elements alive
+        element_dict = self._odt.element_dict
+        for qname, ids in flushed_ids.items():
+            element_dict[qname] = [e for e in element_dict.get(qname, []) if id(e) not in ids]
+
+
+    ''' save the odt - mimetype, styles.xml, content.xml (from the body file), settings.xml, meta.xml, objects, pictures and the manifest
+        in the order odfpy saves them
+    '''
+    def save(self, odt_path):
+        self.flush()
+        self._body_file.close()
+
+        odt = self._odt
+        with zipfile.ZipFile(odt_path, 'w') as z:
+            # odfpy's _savePictures/_saveXmlObjects write through these
+            odt._z = z
+            odt._now = time.localtime()[:6]
+            odt.manifest = manifest.Manifest()
+
+            zi = self.zip_info('mimetype', zipfile.ZIP_STORED)
+            z.writestr(zi, odt.mimetype.encode('utf-8'))
+
+            odt.manifest.addElement(manifest.FileEntry(fullpath='/', mediatype=odt.mimetype))
+            odt.manifest.addElement(manifest.FileEntry(fullpath='styles.xml', mediatype='text/xml'))
+            z.writestr(self.zip_info('styles.xml'), odt.stylesxml().encode('utf-8'))
+
+            odt.manifest.addElement(manifest.FileEntry(fullpath='content.xml', mediatype='text/xml'))
+            self.write_content(z)
+
+            if odt.settings.hasChildNodes():
+                odt.manifest.addElement(manifest.FileEntry(fullpath='settings.xml', mediatype='text/xml'))
+                z.writestr(self.zip_info('settings.xml'), odt.settingsxml().encode('utf-8'))
+
+            odt.manifest.addElement(manifest.FileEntry(fullpath='meta.xml', mediatype='text/xml'))
+            z.writestr(self.zip_info('meta.xml'), odt.metaxml().encode('utf-8'))
+
+            for subobject_number, subobject in enumerate(odt.childobjects, start=1):
+                odt._saveXmlObjects(subobject, f"Object {subobject_number}/")
+
+            odt._savePictures(odt, '')
+
+            if odt.thumbnail is not None:
+                odt.manifest.addElement(manifest.FileEntry(fullpath='Thumbnails/', mediatype=''))
+                odt.manifest.addElement(manifest.FileEntry(fullpath='Thumbnails/thumbnail.png', mediatype=''))
+                z.writestr(self.zip_info('Thumbnails/thumbnail.png'), odt.thumbnail)
+
+            for extra in odt._extra:
+                if extra.filename == 'META-INF/documentsignatures.xml':
+                    continue
+
+                odt.manifest.addElement(manifest.FileEntry(fullpath=extra.filename, mediatype=extra.mediatype))
+                if extra.content is not None:
+                    z.writestr(self.zip_info(extra.filename), extra.content)
+
+            manifest_xml = io.StringIO()
+            manifest_xml.write(XML_PROLOGUE)
+            odt.manifest.toXml(0, manifest_xml)
+            z.writestr(self.zip_info('META-INF/manifest.xml'), manifest_xml.getvalue())
+
+            del odt._z
+            del odt._now
+            del odt.manifest
+
+        os.remove(self._body_path)
+        debug(msg=f"odt body streamed .. {self.flushed} elements")
+
+
+    ''' content.xml - what odfpy's contentxml() writes, with the body copied from the body file
+    '''
+    def write_content(self, z):
+        odt = self._odt
+
+        head = io.StringIO()
+        head.write(XML_PROLOGUE)
+        # at level 0 the document-content tag declares every namespace odfpy has seen, the body elements included
+        DocumentContent().write_open_tag(0, head)
+        if odt.scripts.hasChildNodes():
+            odt.scripts.toXml(1, head)
+
+        if odt.fontfacedecls.hasChildNodes():
+            odt.fontfacedecls.toXml(1, head)
+
+        automatic_styles = AutomaticStyles()
+        style_list = self.used_automatic_styles()
+        if len(style_list) > 0:
+            automatic_styles.write_open_tag(1, head)
+            for automatic_style in style_list:
+                automatic_style.toXml(2, head)
+
+            automatic_styles.write_close_tag(1, head)
+        else:
+            automatic_styles.toXml(1, head)
+
+        odt.body.write_open_tag(1, head)
+        odt.text.write_open_tag(2, head)
+
+        tail = io.StringIO()
+        odt.text.write_close_tag(2, tail)
+        odt.body.write_close_tag(1, tail)
+        DocumentContent().write_close_tag(0, tail)
+
+        head, tail = head.getvalue().encode('utf-8'), tail.getvalue().encode('utf-8')
+        content_size = len(head) + os.path.getsize(self._body_path) + len(tail)
+
+        with z.open(self.zip_info('content.xml'), 'w', force_zip64=(content_size > zipfile.ZIP64_LIMIT)) as content:
+            content.write(head)
+            with open(self._body_path, 'rb') as body_file:
+                while True:
+                    chunk = body_file.read(BODY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+
+                    content.write(chunk)
+
+            content.write(tail)
+
+
+    ''' the automatic styles content.xml needs - those the body, the styles and the automatic styles themselves refer to
+    '''
+    def used_automatic_styles(self):
+        style_names = set(self._style_names)
+        collect_style_names(self._odt.styles, style_names)
+        collect_style_names(self._odt.automaticstyles, style_names)
+
+        return [e for e in self._odt.automaticstyles.childNodes if e.nodeType == Node.ELEMENT_NODE and e.getAttrNS(STYLENS, 'name') in style_names]
+
+
+    ''' zip entry as odfpy writes it
+    '''
+    def zip_info(self, name, compress_type=zipfile.ZIP_DEFLATED):
+        zi = zipfile.ZipInfo(name, self._odt._now)
+        zi.compress_type = compress_type
+        zi.external_attr = UNIXPERMS
+
+        return zi
+
+
+
+''' save goes through odfpy internals (as OpenDocument.save does), stop before anything is generated if this odfpy does not have them
+'''
+def check_odfpy(odt):
+    missing = [member for member in ODFPY_MEMBERS if not hasattr(odt, member)]
+    if len(missing) > 0:
+        error(f"{TOOLSVERSION} does not have {', '.join(missing)}, the odt can not be streamed - install odfpy=={ODFPY_VERSION} or set stream-content to false")
+        raise RuntimeError(f"odfpy {TOOLSVERSION} is not supported by the odt stream writer")
+
+    if TOOLSVERSION != f"ODFPY/{ODFPY_VERSION}":
+        warn(f"the odt stream writer is written against odfpy {ODFPY_VERSION}, this is {TOOLSVERSION}")
+
+
+
+''' names of the styles an element and its descendants refer to, the same attributes odfpy looks at when it picks the automatic styles to save
+'''
+def collect_style_names(element, style_names):
+    for style_reference in STYLE_REFERENCES:
+        style_name = element.attributes.get(style_reference)
+        if style_name:
+            style_names.add(style_name)
+
+    for e in element.childNodes:
+        if e.nodeType == Node.ELEMENT_NODE:
+            collect_style_names(e, style_names)
+
+
+
+''' ids of an element and its descendants by their qname
+'''
+def collect_element_ids(element, element_ids):
+    element_ids.setdefault(element.qname, set()).add(id(element))
+    for e in element.childNodes:
+        if e.nodeType == Node.ELEMENT_NODE:
+            collect_element_ids(e, element_ids)
+
+
+
+# attributes through which an element refers to a style (as in odfpy's OpenDocument._parseoneelement)
+STYLE_REFERENCES = [
+    (CHARTNS, 'style-name'),
+    (DRAWNS, 'style-name'),
+    (DRAWNS, 'text-style-name'),
+    (PRESENTATIONNS, 'style-name'),
+    (STYLENS, 'data-style-name'),
+    (STYLENS, 'list-style-name'),
+    (STYLENS, 'page-layout-name'),
+    (STYLENS, 'style-name'),
+    (TABLENS, 'default-cell-style-name'),
+    (TABLENS, 'style-name'),
+    (TEXTNS, 'style-name'),
+]
+
+XML_PROLOGUE = "<?xml version='1.0' encoding='UTF-8'?>\n"
+
+# the odfpy version the writer is written against (pinned in requirements.txt) and the members of OpenDocument it relies on besides the
+# public ones - _savePictures/_saveXmlObjects write through odt._z/odt._now, which save sets while it writes
+ODFPY_VERSION = '1.4.1'
+ODFPY_MEMBERS = ['_savePictures', '_saveXmlObjects', '_extra', 'childobjects', 'thumbnail', 'Pictures', 'mimetype', 'stylesxml', 'settingsxml', 'metaxml']
+
+# bytes of the body file copied into content.xml at a time
+BODY_CHUNK_SIZE = 1024 * 1024
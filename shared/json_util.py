@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# the json files gsheet-to-json writes and the json-to-* backends read - used by all of them from shared/ at the root of the repository,
+# logging goes through the helper.logger of the package that runs
+
+import copy
+import gzip
+import io
+import json
+from pathlib import Path
+
+from helper.logger import *
+
+try:
+    import zstandard
+except ImportError:
+    # .json.zst output/input needs the zstandard package
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    # .msgpack output/input needs the msgpack package
+    msgpack = None
+
+
+""" format of an output/input file by its extension - .json, .json.gz (gzip), .json.zst (zstandard) or .msgpack (MessagePack)
+"""
+
+
+def json_format(path):
+    name = str(path).lower()
+    for fmt in JSON_FORMATS:
+        if name.endswith(fmt):
+            return fmt
+
+    return ".json"
+
+
+""" a text stream to write json to, compressed as the format (the extension, unless given) says
+"""
+
+
+def open_json_writer(path, fmt=None):
+    if fmt is None:
+        fmt = json_format(path)
+
+    if fmt == ".json.gz":
+        return gzip.open(path, "wt", encoding="utf-8", compresslevel=GZIP_LEVEL)
+
+    if fmt == ".json.zst":
+        compressor = required(zstandard, "zstandard", path).ZstdCompressor(
+            level=ZSTD_LEVEL, threads=-1
+        )
+        return io.TextIOWrapper(
+            compressor.stream_writer(open(path, "wb"), closefd=True), encoding="utf-8"
+        )
+
+    return open(path, "w", encoding="utf-8")
+
+
+""" the input file for a json name - whichever of <name>.json/.json.gz/.json.zst/.msgpack in the directory is the newest,
+    <name>.json if there is none
+"""
+
+
+def find_input_json(input_dir, name):
+    candidates = [Path(f"{input_dir}/{name}{ext}") for ext in JSON_FORMATS]
+    candidates = [path for path in candidates if path.exists()]
+    if len(candidates) == 0:
+        return f"{input_dir}/{name}.json"
+
+    return str(max(candidates, key=lambda path: path.stat().st_mtime))
+
+
+""" read a json/.json.gz/.json.zst/.msgpack file as it is, worksheet references and the worksheets table included
+"""
+
+
+def read_json_file(path):
+    fmt = json_format(path)
+    if fmt == ".msgpack":
+        with open(path, "rb") as f:
+            return required(msgpack, "msgpack", path).unpack(
+                f, raw=False, strict_map_key=False
+            )
+
+    if fmt == ".json.gz":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    if fmt == ".json.zst":
+        decompressor = required(zstandard, "zstandard", path).ZstdDecompressor()
+        with open(path, "rb") as f:
+            with io.TextIOWrapper(
+                decompressor.stream_reader(f), encoding="utf-8"
+            ) as reader:
+                return json.load(reader)
+
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+""" read a json/.json.gz/.json.zst/.msgpack file and resolve its worksheet references - what the backends render from
+"""
+
+
+def load_json_file(path):
+    # header/footer worksheets are stored once and referenced by key from the sections
+    return resolve_worksheet_refs(read_json_file(path))
+
+
+""" the optional module a format needs, an error naming the package if it is not installed
+"""
+
+
+def required(module, package, path):
+    if module is None:
+        error(f"[{path}] needs the {package} package : pip install {package}")
+        raise ImportError(f"{package} is not installed")
+
+    return module
+
+
+""" replace the worksheet references ({'worksheet-ref': key}) in the header/footer slots of the sections (and of the sections of
+    nested gsheets) with the worksheets from the top level worksheets table, the table itself is removed from data
+    each section gets a copy of the worksheet, a backend that changes the header/footer of one section does not change the others
+"""
+
+
+def resolve_worksheet_refs(data):
+    worksheets = data.pop("worksheets", {})
+    resolve_section_list(data.get("sections", []), worksheets)
+
+    return data
+
+
+def resolve_section_list(section_list, worksheets):
+    for section_data in section_list:
+        for slot in HEADER_FOOTER_SLOTS:
+            value = section_data.get(slot)
+            if isinstance(value, dict) and len(value) == 1 and "worksheet-ref" in value:
+                if value["worksheet-ref"] in worksheets:
+                    section_data[slot] = copy.deepcopy(
+                        worksheets[value["worksheet-ref"]]
+                    )
+                else:
+                    warn(
+                        f"worksheet [{value['worksheet-ref']}] referenced by section [{section_data['section-meta']['section-name']}] is not in the json"
+                    )
+                    section_data[slot] = {}
+
+        contents = section_data.get("contents")
+        if section_data.get("section-prop", {}).get(
+            "content-type"
+        ) == "gsheet" and isinstance(contents, dict):
+            resolve_section_list(contents.get("sections", []), worksheets)
+
+
+# the formats, by extension (.json last, it is the suffix of the compressed ones)
+JSON_FORMATS = [".json.gz", ".json.zst", ".msgpack", ".json"]
+
+# compression levels, fast rather than small - the file is written once and read by every backend
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# the section keys that hold header/footer worksheets
+HEADER_FOOTER_SLOTS = [
+    "header-first",
+    "header-odd",
+    "header-even",
+    "footer-first",
+    "footer-odd",
+    "footer-even",
+]
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+''' per section render cache
+'''
+
+# the sections rendered by the backends that cache them (json-to-latex, json-to-context and json-to-odt) - used by all of them from shared/
+# at the root of the repository, logging goes through the helper.logger of the package that runs
+# json-to-docx has no render cache, python-docx builds one document tree and a section can not be taken out of it and put back
+
+import os
+import json
+import pickle
+import hashlib
+import threading
+from pathlib import Path
+
+from helper.logger import *
+
+class RenderCache(object):
+
+    ''' constructor
+        rendered sections are key'ed by the section fingerprint (from gsheet-to-json) together with the configuration and the
+        files that decide how a section renders (the source of the modules that render, a template), so that a change in any of them
+        invalidates everything
+    '''
+    def __init__(self, cache_dir, config, source_files, max_size_mb=200):
+        self._cache_dir = Path(cache_dir)
+        self._cache_dir.mkdir(parents=True, exist_ok=True)
+        self._max_size = int(max_size_mb) * 1024 * 1024
+
+        digest = hashlib.sha256()
+        digest.update(json.dumps({k: v for k, v in config.items() if k not in ['files', 'render-cache', 'section-cache']}, sort_keys=True, default=str).encode('utf-8'))
+        for source_file in source_files:
+            with open(source_file, 'rb') as f:
+                digest.update(f.read())
+
+        self._digest = digest.hexdigest()
+
+
+
+    ''' render a section through the cache
+        render(**dicts) renders the section into fresh dicts, what it adds to them is recorded with the lines and replayed on a cache hit
+        so that the shared dicts (colors, headers/footers, footnotes ...) end up the same either way
+    '''
+    def render(self, fingerprint, render, shared_dicts):
+        path = self.path(fingerprint)
+        entry = self.get(path)
+        if entry is None:
+            fresh_dicts = {name: {} for name in shared_dicts.keys()}
+            lines = render(**fresh_dicts)
+            entry = {'lines': lines, 'dicts': fresh_dicts}
+            self.put(path, entry)
+
+        for name, d in entry['dicts'].items():
+            for k, v in d.items():
+                shared_dicts[name].setdefault(k, v)
+
+        return entry['lines']
+
+
+
+    ''' cache file of a section
+    '''
+    def path(self, fingerprint):
+        key = hashlib.sha256(f"{fingerprint}|{self._digest}".encode('utf-8')).hexdigest()
+        return self._cache_dir / f"{key}.pickle"
+
+
+
+    ''' cached entry, None if not cached (or not readable)
+    '''
+    def get(self, path):
+        if not path.exists():
+            return None
+
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+
+            # touch it, eviction is least recently used first
+            os.utime(path, None)
+
+        except Exception as e:
+            warn(f"render cache entry [{path}] is not readable : {e}")
+            return None
+
+        return entry
+
+
+
+    ''' store an entry (atomically)
+    '''
+    def put(self, path, entry):
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp_path, path)
+
+
+
+    ''' remove least recently used entries until the cache fits its size limit
+    '''
+    def evict(self):
+        entries = []
+        for path in self._cache_dir.iterdir():
+            # entries being written are left alone, entries of older versions of the cache (never read again) age out as any other
+            if path.name.endswith('.tmp'):
+                continue
+
+            try:
+                stat = path.stat()
+                entries.append((stat.st_mtime, stat.st_size, path))
+            except FileNotFoundError:
+                pass
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda x: x[0]):
+            if total_size <= self._max_size:
+                break
+
+            try:
+                path.unlink()
+                total_size = total_size - size
+            except FileNotFoundError:
+                pass